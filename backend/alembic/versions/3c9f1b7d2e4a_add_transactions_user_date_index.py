@@ -0,0 +1,43 @@
+"""add_transactions_user_date_index
+
+Revision ID: 3c9f1b7d2e4a
+Revises: ed02e8adb8d4
+Create Date: 2026-10-17 10:12:41.208317
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = '3c9f1b7d2e4a'
+down_revision: Union[str, None] = 'ed02e8adb8d4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Reports filter by user_id (or user_id IN (...)) and a date range; covering
+    # type/amount/category and organization_id (the personal-only filter) lets
+    # get_report_aggregates run as an index-only scan on a vacuumed table.
+    # CONCURRENTLY cannot run inside a transaction, hence the autocommit block.
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'idx_transactions_user_date',
+            'transactions',
+            ['user_id', sa.text('date DESC')],
+            postgresql_include=['type', 'amount', 'category', 'organization_id'],
+            postgresql_concurrently=True,
+            if_not_exists=True
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'idx_transactions_user_date',
+            table_name='transactions',
+            postgresql_concurrently=True,
+            if_exists=True
+        )
@@ -82,9 +82,16 @@ class PrivacyAgent:
             "quién ve", "who sees", "compartir", "share", "terceros", "third party",
             "encriptación", "encryption", "seguro", "secure", "confidencial", "confidential"
         ]
+        self._min_kw_len = min(len(keyword) for keyword in self.privacy_keywords)
     
     def is_privacy_request(self, message: str) -> bool:
         """Detect if a message is about privacy or data protection."""
+        # Fast path: amounts like "500" or "₡1,200" can never contain a keyword
+        if len(message) < self._min_kw_len:
+            return False
+        if not any(c.isalpha() for c in message):
+            return False
+        
         message_lower = message.lower()
         return any(keyword in message_lower for keyword in self.privacy_keywords)
     
@@ -1,36 +1,227 @@
-from crewai import Agent, Task, Crew
-from datetime import datetime, timedelta
-from typing import Dict, Any, List, Optional
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from operator import itemgetter
+from types import MappingProxyType
+from typing import TYPE_CHECKING, Dict, Any, List, Optional
 from sqlalchemy.orm import Session
 from app.core.llm_config import get_openai_config
 from app.services.transaction_service import TransactionService
-from app.services.organization_service import OrganizationService
 from app.models.transaction import TransactionType
-from app.tools.report_tools import (
-    get_transaction_data_tool,
-    format_report_tool, 
-    detect_report_type_tool
-)
 import calendar
+import heapq
+import logging
+import os
+import re
+
+# crewai (and the report tools built on it) pull in LiteLLM and friends,
+# so they are imported only once a report is actually generated
+if TYPE_CHECKING:
+    from crewai import Crew
+
+logger = logging.getLogger(__name__)
+
+# Keyword tables, built once at import
+REPORT_KEYWORDS = (
+    "resumen", "resume", "reporte", "gastos", "total", "cuanto", "cuánto",
+    "balance", "estado", "informe", "hasta hoy", "esta semana", "este mes",
+    "mes pasado", "semana pasada", "últimos", "ultimos", "balance del mes",
+    "mis gastos", "mis ingresos", "total gastos", "total ingresos",
+    "¿cuanto", "¿cuánto", "cómo voy", "como voy",
+    # Family keywords
+    "gastos familia", "gastos familiares", "balance familia", "balance familiar",
+    "reporte familia", "reporte familiar", "resumen familia", "resumen familiar",
+    "familia gastos", "familiar gastos"
+)
+
+# Organization filter per report, checked in order: the first filter with a
+# matching keyword wins. The detect_report_type tool reads the same table, so
+# cached reports are flagged as family exactly when the crew reports on family
+ORGANIZATION_KEYWORDS = (
+    ("personal", ("personal", "mío", "mio", "propio", "individual")),
+    ("family", ("familia", "familiar", "family", "mi hogar", "hogar", "casa")),
+    ("empresa", ("empresa", "trabajo", "work", "negocio")),
+)
+
+# Checked in order, the first period with a matching keyword wins
+PERIOD_KEYWORDS = (
+    ("today", ("hoy", "today", "hasta hoy")),
+    ("this_week", ("esta semana", "semana actual")),
+    ("last_week", ("semana pasada", "última semana", "ultima semana")),
+    ("this_month", ("este mes", "mes actual")),
+    ("last_month", ("mes pasado", "último mes", "ultimo mes")),
+    ("last_7_days", ("últimos 7", "ultimos 7", "última semana")),
+    ("last_30_days", ("últimos 30", "ultimos 30")),
+)
+
+# Read-only so the shared table can't be mutated by a caller
+PERIOD_NAMES = MappingProxyType({
+    "today": "hoy",
+    "this_week": "esta semana",
+    "last_week": "la semana pasada",
+    "this_month": "este mes",
+    "last_month": "el mes pasado",
+    "last_7_days": "los últimos 7 días",
+    "last_30_days": "los últimos 30 días"
+})
+
+# Static instructions first and per-request values last, so the prompt prefix
+# is identical across requests and provider-side prompt caching can reuse it
+REPORT_TASK_TEMPLATE = """Genera un reporte financiero usando las herramientas disponibles.
+
+PROCESO OBLIGATORIO:
+1. USA "detect_report_type" para analizar la solicitud del usuario
+2. USA "get_transaction_data" con los parámetros detectados y el USER_ID indicado
+3. USA "format_report" para crear el reporte final con la MONEDA indicada como currency_symbol
+
+IMPORTANTE:
+• SIEMPRE usa las 3 herramientas en orden
+• NO inventes datos, usa solo lo que devuelvan las herramientas
+• Formato final para WhatsApp (máximo 500 caracteres)
+• Responde en español con tono motivador
+
+SOLICITUD DEL USUARIO: "{message}"
+USER_ID: {user_id}
+MONEDA: {currency_symbol}"""
+
+# The report process needs three tool calls plus the final answer
+REPORT_MAX_ITER = 5
+
+# CrewAI's verbose mode prints every prompt and response to stdout; opt in for debugging
+CREWAI_VERBOSE = os.getenv("CREWAI_VERBOSE", "0") == "1"
+
+# Rendered reports, reused when a user repeats the same request shortly after
+_REPORT_CACHE_TTL = timedelta(seconds=60)
+_REPORT_CACHE_MAX = 1024
+_report_cache: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+
+
+def _get_cached_report(key: tuple) -> Optional[Dict[str, Any]]:
+    """Return a cached report if it exists and hasn't expired."""
+    entry = _report_cache.get(key)
+    if entry is None:
+        return None
+    if datetime.now() > entry["expires_at"]:
+        _report_cache.pop(key, None)
+        return None
+    try:
+        _report_cache.move_to_end(key)
+    except KeyError:
+        pass  # Invalidated concurrently, the entry itself is still valid to return
+    return entry["report"]
+
+
+def _cache_report(key: tuple, report: Dict[str, Any]) -> None:
+    """Store a rendered report for a short time."""
+    _report_cache[key] = {
+        "report": report,
+        "expires_at": datetime.now() + _REPORT_CACHE_TTL
+    }
+    _report_cache.move_to_end(key)
+    # Evict least recently used reports beyond the size limit
+    while len(_report_cache) > _REPORT_CACHE_MAX:
+        _report_cache.popitem(last=False)
+
+
+def invalidate_report_cache(user_id: str) -> None:
+    """Drop cached reports that may include the user's transactions.
+    
+    Family reports aggregate several users, so every cached family report goes too.
+    """
+    user_id = str(user_id)
+    for key in list(_report_cache):
+        if key[0] == user_id or key[2]:
+            _report_cache.pop(key, None)
+
+
+def _keyword_pattern(keywords) -> re.Pattern:
+    """Compile literal keywords into a single alternation regex."""
+    return re.compile("|".join(map(re.escape, keywords)))
+
+
+_REPORT_RE = _keyword_pattern(REPORT_KEYWORDS)
+
+# One named group per period, in PERIOD_KEYWORDS priority order. The
+# lookahead makes the match zero-width, so a keyword is still found when
+# it overlaps another one (e.g. "última semana actual").
+_PERIOD_RE = re.compile("(?=" + "|".join(
+    f"(?P<{period}>{'|'.join(map(re.escape, keywords))})"
+    for period, keywords in PERIOD_KEYWORDS
+) + ")")
+_PERIOD_PRIORITY = {period: priority for priority, (period, _) in enumerate(PERIOD_KEYWORDS)}
+
+
+def is_report_request(message: str) -> bool:
+    """Detect if a message is requesting a report or summary.
+    
+    Module-level so message classification doesn't need a ReportAgent (or crewai).
+    """
+    return bool(_REPORT_RE.search(message.lower()))
+
+
+@lru_cache(maxsize=64)
+def _date_range(period: str, today: date) -> tuple:
+    """Get start and end dates for the specified period relative to today.
+    
+    Pure function of (period, today), so results are memoized until the date changes.
+    """
+    if period == "today":
+        return today, today
+    elif period == "this_week":
+        days_since_monday = today.weekday()
+        monday = today - timedelta(days=days_since_monday)
+        return monday, today
+    elif period == "last_week":
+        days_since_monday = today.weekday()
+        last_monday = today - timedelta(days=days_since_monday + 7)
+        last_sunday = last_monday + timedelta(days=6)
+        return last_monday, last_sunday
+    elif period == "this_month":
+        first_day = today.replace(day=1)
+        return first_day, today
+    elif period == "last_month":
+        first_current = today.replace(day=1)
+        last_month_end = first_current - timedelta(days=1)
+        last_month_start = last_month_end.replace(day=1)
+        return last_month_start, last_month_end
+    elif period == "last_7_days":
+        seven_days_ago = today - timedelta(days=7)
+        return seven_days_ago, today
+    elif period == "last_30_days":
+        thirty_days_ago = today - timedelta(days=30)
+        return thirty_days_ago, today
+    else:
+        # Default to this month
+        first_day = today.replace(day=1)
+        return first_day, today
+
 
 class ReportAgent:
     """Intelligent agent to generate financial reports and summaries from natural language requests."""
     
-    def __init__(self, db: Session = None):
-        self.db = db
-        
+    _ORGANIZATION_PATTERNS = tuple(
+        (_keyword_pattern(keywords), organization) for organization, keywords in ORGANIZATION_KEYWORDS
+    )
+    
+    def __init__(self):
         try:
+            from crewai import Agent
+            from app.tools.report_tools import (
+                get_transaction_data_tool,
+                format_report_tool,
+                detect_report_type_tool
+            )
+            
             # Setup OpenAI environment
             self.has_openai = get_openai_config()
             
-            # Initialize tools for the report agent
-            self.tools = []
-            if db:
-                self.tools = [
-                    get_transaction_data_tool,
-                    format_report_tool,
-                    detect_report_type_tool
-                ]
+            # Tools read the request's db session from set_report_tool_context,
+            # so they are wired once and the agent is never reconfigured
+            self.tools = [
+                get_transaction_data_tool,
+                format_report_tool,
+                detect_report_type_tool
+            ]
             
             if self.has_openai:
                 self.agent = Agent(
@@ -67,88 +258,78 @@ ESTILO COSTARRICENSE:
 • Lenguaje motivador y amigable
 
 NUNCA inventes datos. SIEMPRE usa las herramientas para obtener información real.""",
-                    verbose=True,
+                    verbose=CREWAI_VERBOSE,
                     allow_delegation=False,
+                    # Cap the LLM round-trips instead of letting a confused run loop
+                    # up to CrewAI's default iteration limit
+                    max_iter=REPORT_MAX_ITER,
                     tools=self.tools  # 🔧 Usando CrewAI tools feature
                 )
             else:
                 self.agent = None
         except Exception as e:
-            print(f"Warning: Failed to initialize ReportAgent: {e}")
+            logger.warning("Failed to initialize ReportAgent: %s", e)
             self.has_openai = False
             self.agent = None
     
+    @staticmethod
+    def invalidate(user_id: str) -> None:
+        """Forget cached reports affected by a change to the user's transactions."""
+        invalidate_report_cache(user_id)
+    
     def is_report_request(self, message: str) -> bool:
         """Detect if a message is requesting a report or summary."""
-        report_keywords = [
-            "resumen", "resume", "reporte", "gastos", "total", "cuanto", "cuánto",
-            "balance", "estado", "informe", "hasta hoy", "esta semana", "este mes",
-            "mes pasado", "semana pasada", "últimos", "ultimos", "balance del mes",
-            "mis gastos", "mis ingresos", "total gastos", "total ingresos",
-            "¿cuanto", "¿cuánto", "cómo voy", "como voy",
-            # Family keywords
-            "gastos familia", "gastos familiares", "balance familia", "balance familiar",
-            "reporte familia", "reporte familiar", "resumen familia", "resumen familiar",
-            "familia gastos", "familiar gastos"
-        ]
-        
-        message_lower = message.lower()
-        return any(keyword in message_lower for keyword in report_keywords)
+        return is_report_request(message)
     
     def generate_report(self, message: str, user_id: str, db: Session, currency_symbol: str = "₡") -> Dict[str, Any]:
         """Generate a financial report based on the user's natural language request."""
+        # Parse the request once; the cache key and the data query share it
+        period = self._extract_time_period(message)
+        is_family_report = self._is_family_report_request(message)
         
-        # Update db reference for tools
-        if self.db != db:
-            self.db = db
-            # Re-initialize tools with new db
-            if db and self.has_openai:
-                self.tools = [
-                    get_transaction_data_tool,
-                    format_report_tool,
-                    detect_report_type_tool
-                ]
-                # Update agent tools
-                self.agent.tools = self.tools
+        cache_key = self._report_cache_key(message, user_id, currency_symbol, period, is_family_report)
+        report = _get_cached_report(cache_key)
+        if report is None:
+            report = self._generate_report(message, user_id, db, currency_symbol, period, is_family_report)
+            _cache_report(cache_key, report)
+        return report
+    
+    def _report_cache_key(self, message: str, user_id: str, currency_symbol: str,
+                          period: str, is_family_report: bool) -> tuple:
+        """Key reports by what they contain rather than by the raw message wording.
+        
+        The AI crew also reads details like "personal" or "detallado" from the
+        message, so its reports are additionally keyed by the normalized text.
+        """
+        ai_message = message.lower().strip() if self.has_openai and self.agent else None
+        return (
+            str(user_id),
+            period,
+            is_family_report,
+            currency_symbol,
+            ai_message
+        )
+    
+    def _generate_report(self, message: str, user_id: str, db: Session, currency_symbol: str,
+                         period: str, is_family_report: bool) -> Dict[str, Any]:
+        """Build a report from the database and, when available, the AI crew."""
+        
+        from app.tools.report_tools import set_report_tool_context
+        set_report_tool_context(db)
         
         # Get transactions data first
-        transactions_data = self._get_transactions_data(user_id, db, message)
+        transactions_data = self._get_transactions_data(user_id, db, period, is_family_report)
         
         if not self.has_openai or not self.agent:
             # Fallback without AI
             return self._generate_simple_report(transactions_data, currency_symbol, message)
         
+        if transactions_data["total_transactions"] == 0:
+            # Nothing to analyze, skip the LLM round-trips
+            return self._generate_simple_report(transactions_data, currency_symbol, message)
+        
         try:
-            task = Task(
-                description=f"""
-                Genera un reporte financiero usando las herramientas disponibles.
-                
-                SOLICITUD DEL USUARIO: "{message}"
-                USER_ID: {user_id}
-                MONEDA: {currency_symbol}
-                
-                PROCESO OBLIGATORIO:
-                1. USA "detect_report_type" para analizar la solicitud: "{message}"
-                2. USA "get_transaction_data" con los parámetros detectados (user_id: {user_id})
-                3. USA "format_report" para crear el reporte final con currency_symbol: {currency_symbol}
-                
-                IMPORTANTE:
-                • SIEMPRE usa las 3 herramientas en orden
-                • NO inventes datos, usa solo lo que devuelvan las herramientas
-                • Formato final para WhatsApp (máximo 500 caracteres)
-                • Responde en español con tono motivador
-                """,
-                agent=self.agent,
-                expected_output="Reporte financiero generado usando herramientas especializadas"
-            )
-            
-            crew = Crew(
-                agents=[self.agent],
-                tasks=[task],
-                memory=True,  # 🧠 Enable memory for report context
-                verbose=False
-            )
-            
+            crew = self._build_report_crew(message, user_id, currency_symbol)
             result = crew.kickoff()
             
             return {
@@ -157,231 +338,183 @@ NUNCA inventes datos. SIEMPRE usa las herramientas para obtener información rea
                 "data": transactions_data
             }
             
-        except Exception as e:
-            print(f"ReportAgent failed: {e}")
+        except Exception:
+            logger.exception("ReportAgent failed, falling back to simple report")
             return self._generate_simple_report(transactions_data, currency_symbol, message)
     
+    def _build_report_crew(self, message: str, user_id: str, currency_symbol: str) -> "Crew":
+        """Build the Crew that runs the report tools for a single request."""
+        from crewai import Task, Crew
+        
+        # The shared agent keeps its executor on the instance while a task runs,
+        # so each request works on its own copy of the configured agent
+        agent = self.agent.copy()
+        task = Task(
+            description=REPORT_TASK_TEMPLATE.format(
+                message=message,
+                user_id=user_id,
+                currency_symbol=currency_symbol
+            ),
+            agent=agent,
+            expected_output="Reporte financiero generado usando herramientas especializadas"
+        )
+        
+        return Crew(
+            agents=[agent],
+            tasks=[task],
+            memory=False,  # Stateless report, skip per-kickoff memory store I/O
+            verbose=False
+        )
+    
     def _is_family_report_request(self, message: str) -> bool:
         """Detect if user is requesting a family report."""
-        family_keywords = [
-            "familia", "familiar", "family"
-        ]
         message_lower = message.lower()
-        return any(keyword in message_lower for keyword in family_keywords)
+        for pattern, organization in self._ORGANIZATION_PATTERNS:
+            if pattern.search(message_lower):
+                return organization == "family"
+        return False
     
-    def _get_transactions_data(self, user_id: str, db: Session, message: str) -> Dict[str, Any]:
-        """Extract transaction data based on the time period mentioned in the message."""
+    def _get_transactions_data(self, user_id: str, db: Session, period: str, is_family_report: bool) -> Dict[str, Any]:
+        """Extract transaction data for the requested period, for the user or their family."""
         
-        # Determine time period from message
-        period = self._extract_time_period(message)
         start_date, end_date = self._get_date_range(period)
         
-        # Check if this is a family report request
-        is_family_report = self._is_family_report_request(message)
-        
-        # Debug: Print date range
-        print(f"DEBUG: Searching transactions for user {user_id}")
-        print(f"DEBUG: Date range: {start_date} to {end_date}")
-        print(f"DEBUG: Period: {period}")
-        print(f"DEBUG: Family report: {is_family_report}")
+        logger.debug(
+            "Searching transactions for user %s from %s to %s (period=%s, family=%s)",
+            user_id, start_date, end_date, period, is_family_report
+        )
         
-        # Get transactions (individual or family)
+        # Aggregate transactions in SQL (individual or family)
         if is_family_report:
-            transactions = self._get_family_transactions(db, user_id, start_date, end_date)
+            user_ids = self._get_family_member_ids(db, user_id)
         else:
-            transactions = TransactionService.get_transactions_by_date_range(
-                db, user_id, start_date, end_date
-            )
+            user_ids = [user_id]
         
-        # Debug: Print results
-        print(f"DEBUG: Found {len(transactions)} transactions")
-        for t in transactions[:3]:  # Show first 3
-            print(f"DEBUG: Transaction date: {t.date}, amount: {t.amount}")
+        rows = TransactionService.get_report_aggregates(db, user_ids, start_date, end_date)
         
-        # Calculate totals
-        total_expenses = sum(float(t.amount) for t in transactions if t.type == TransactionType.expense)
-        total_income = sum(float(t.amount) for t in transactions if t.type == TransactionType.income)
-        
-        # Group by category
+        # Calculate totals, counts and category sums in a single pass
+        expense_type = TransactionType.expense
+        income_type = TransactionType.income
+        total_expenses = 0.0
+        total_income = 0.0
+        expense_count = 0
+        income_count = 0
         category_totals = {}
-        for transaction in transactions:
-            if transaction.type == TransactionType.expense:
-                category = transaction.category or "Sin categoría"
-                category_totals[category] = category_totals.get(category, 0) + float(transaction.amount)
+        for transaction_type, category, amount, count in rows:
+            amount = float(amount)
+            if transaction_type is expense_type:
+                total_expenses += amount
+                expense_count += count
+                category = category or "Sin categoría"
+                category_totals[category] = category_totals.get(category, 0.0) + amount
+            elif transaction_type is income_type:
+                total_income += amount
+                income_count += count
+        
+        total_transactions = expense_count + income_count
+        logger.debug("Found %d transactions", total_transactions)
         
         # Sort categories by amount
-        top_categories = sorted(category_totals.items(), key=lambda x: x[1], reverse=True)[:5]
+        top_categories = heapq.nlargest(5, category_totals.items(), key=itemgetter(1))
         
         return {
             "period": period,
             "start_date": start_date,
             "end_date": end_date,
             "is_family_report": is_family_report,
-            "total_transactions": len(transactions),
+            "total_transactions": total_transactions,
             "total_expenses": total_expenses,
             "total_income": total_income,
             "net_balance": total_income - total_expenses,
             "top_categories": top_categories,
             "transaction_count_by_type": {
-                "expenses": len([t for t in transactions if t.type == TransactionType.expense]),
-                "income": len([t for t in transactions if t.type == TransactionType.income])
+                "expenses": expense_count,
+                "income": income_count
             }
         }
     
     def _extract_time_period(self, message: str) -> str:
         """Extract time period from natural language message."""
-        message_lower = message.lower()
-        
-        if any(word in message_lower for word in ["hoy", "today", "hasta hoy"]):
-            return "today"
-        elif any(word in message_lower for word in ["esta semana", "semana actual"]):
-            return "this_week"
-        elif any(word in message_lower for word in ["semana pasada", "última semana", "ultima semana"]):
-            return "last_week"
-        elif any(word in message_lower for word in ["este mes", "mes actual"]):
-            return "this_month"
-        elif any(word in message_lower for word in ["mes pasado", "último mes", "ultimo mes"]):
-            return "last_month"
-        elif any(word in message_lower for word in ["últimos 7", "ultimos 7", "última semana"]):
-            return "last_7_days"
-        elif any(word in message_lower for word in ["últimos 30", "ultimos 30"]):
-            return "last_30_days"
-        else:
+        # Single scan; when several periods are mentioned the earliest in
+        # PERIOD_KEYWORDS wins, same as checking them one by one
+        found = {match.lastgroup for match in _PERIOD_RE.finditer(message.lower())}
+        if not found:
             return "this_month"  # Default
+        return min(found, key=_PERIOD_PRIORITY.__getitem__)
     
     def _get_date_range(self, period: str) -> tuple:
         """Get start and end dates for the specified period."""
-        now = datetime.now()
-        today = now.date()
-        
-        # Debug: Print current date info
-        print(f"DEBUG: Current datetime: {now}")
-        print(f"DEBUG: Current date: {today}")
-        print(f"DEBUG: Current year: {today.year}, month: {today.month}")
-        
-        if period == "today":
-            return today, today
-        elif period == "this_week":
-            days_since_monday = today.weekday()
-            monday = today - timedelta(days=days_since_monday)
-            return monday, today
-        elif period == "last_week":
-            days_since_monday = today.weekday()
-            last_monday = today - timedelta(days=days_since_monday + 7)
-            last_sunday = last_monday + timedelta(days=6)
-            return last_monday, last_sunday
-        elif period == "this_month":
-            first_day = today.replace(day=1)
-            return first_day, today
-        elif period == "last_month":
-            first_current = today.replace(day=1)
-            last_month_end = first_current - timedelta(days=1)
-            last_month_start = last_month_end.replace(day=1)
-            return last_month_start, last_month_end
-        elif period == "last_7_days":
-            seven_days_ago = today - timedelta(days=7)
-            return seven_days_ago, today
-        elif period == "last_30_days":
-            thirty_days_ago = today - timedelta(days=30)
-            return thirty_days_ago, today
-        else:
-            # Default to this month
-            first_day = today.replace(day=1)
-            return first_day, today
+        return _date_range(period, datetime.now().date())
     
     def _format_transactions_for_ai(self, data: Dict[str, Any], currency_symbol: str) -> str:
         """Format transaction data for AI consumption."""
-        period_names = {
-            "today": "hoy",
-            "this_week": "esta semana",
-            "last_week": "la semana pasada",
-            "this_month": "este mes",
-            "last_month": "el mes pasado",
-            "last_7_days": "los últimos 7 días",
-            "last_30_days": "los últimos 30 días"
-        }
-        
-        period_text = period_names.get(data["period"], data["period"])
-        
-        report = f"""
-        Período: {period_text}
-        Total de transacciones: {data["total_transactions"]}
-        Gastos totales: {currency_symbol}{data["total_expenses"]:,.0f}
-        Ingresos totales: {currency_symbol}{data["total_income"]:,.0f}
-        Balance neto: {currency_symbol}{data["net_balance"]:,.0f}
-        
-        Principales categorías de gastos:
-        """
-        
-        for i, (category, amount) in enumerate(data["top_categories"][:3], 1):
-            report += f"\n{i}. {category}: {currency_symbol}{amount:,.0f}"
+        period_text = PERIOD_NAMES.get(data["period"], data["period"])
+        
+        lines = [
+            f"Período: {period_text}",
+            f"Total de transacciones: {data['total_transactions']}",
+            f"Gastos totales: {currency_symbol}{data['total_expenses']:,.0f}",
+            f"Ingresos totales: {currency_symbol}{data['total_income']:,.0f}",
+            f"Balance neto: {currency_symbol}{data['net_balance']:,.0f}",
+            "",
+            "Principales categorías de gastos:"
+        ]
+        lines.extend(
+            f"{i}. {category}: {currency_symbol}{amount:,.0f}"
+            for i, (category, amount) in enumerate(data["top_categories"][:3], 1)
+        )
         
-        return report
+        return "\n".join(lines)
     
     def _generate_simple_report(self, data: Dict[str, Any], currency_symbol: str, original_message: str) -> Dict[str, Any]:
         """Generate a simple report without AI when OpenAI is not available."""
         
-        period_names = {
-            "today": "hoy",
-            "this_week": "esta semana", 
-            "last_week": "la semana pasada",
-            "this_month": "este mes",
-            "last_month": "el mes pasado",
-            "last_7_days": "los últimos 7 días",
-            "last_30_days": "los últimos 30 días"
-        }
-        
-        period_text = period_names.get(data["period"], data["period"])
-        
-        # Add family indicator if it's a family report
-        report_type = "📊 **Resumen Familiar de" if data.get("is_family_report", False) else "📊 **Resumen de"
-        report = f"{report_type} {period_text}**\n\n"
-        report += f"💸 Gastos: {currency_symbol}{data['total_expenses']:,.0f}\n"
-        report += f"💰 Ingresos: {currency_symbol}{data['total_income']:,.0f}\n"
-        report += f"📈 Balance: {currency_symbol}{data['net_balance']:,.0f}\n"
-        
-        if data["top_categories"]:
-            report += f"\n🏆 **Top categorías:**\n"
-            for category, amount in data["top_categories"][:3]:
-                report += f"• {category}: {currency_symbol}{amount:,.0f}\n"
+        period_text = PERIOD_NAMES.get(data["period"], data["period"])
         
         if data["total_transactions"] == 0:
             report = f"No tienes transacciones registradas para {period_text} 📝"
+        else:
+            # Add family indicator if it's a family report
+            report_type = "📊 **Resumen Familiar de" if data.get("is_family_report", False) else "📊 **Resumen de"
+            lines = [
+                f"{report_type} {period_text}**",
+                "",
+                f"💸 Gastos: {currency_symbol}{data['total_expenses']:,.0f}",
+                f"💰 Ingresos: {currency_symbol}{data['total_income']:,.0f}",
+                f"📈 Balance: {currency_symbol}{data['net_balance']:,.0f}"
+            ]
+            
+            if data["top_categories"]:
+                lines.append("")
+                lines.append("🏆 **Top categorías:**")
+                lines.extend(
+                    f"• {category}: {currency_symbol}{amount:,.0f}"
+                    for category, amount in data["top_categories"][:3]
+                )
+            
+            report = "\n".join(lines)
         
         return {
             "success": True,
-            "report": report.strip(),
+            "report": report,
             "data": data
         }
     
-    def _get_family_transactions(self, db: Session, user_id: str, start_date, end_date) -> List:
-        """Get transactions for all organization members the user belongs to."""
-        from datetime import datetime, time
-        
-        # Get user's organizations
-        user_organizations = OrganizationService.get_user_organizations(db, user_id)
-        
-        if not user_organizations:
-            # No organizations, return individual transactions
-            return TransactionService.get_transactions_by_date_range(
-                db, user_id, start_date, end_date
-            )
-        
-        all_transactions = []
+    def _get_family_member_ids(self, db: Session, user_id: str) -> List[str]:
+        """Get the IDs of all members of the organizations the user belongs to."""
+        from app.services.organization_service import OrganizationService
         
-        for organization in user_organizations:
-            # Get all organization members
-            organization_members = OrganizationService.get_organization_members(db, str(organization.id))
-            
-            for member in organization_members:
-                # Get transactions for each member
-                member_transactions = TransactionService.get_transactions_by_date_range(
-                    db, str(member.user_id), start_date, end_date
-                )
-                all_transactions.extend(member_transactions)
-        
-        # Remove duplicates and sort by date
-        unique_transactions = list(set(all_transactions))
-        unique_transactions.sort(key=lambda x: x.date, reverse=True)
+        member_ids = OrganizationService.get_member_ids_for_user_orgs(db, user_id)
         
-        return unique_transactions
\ No newline at end of file
+        # No organizations, report on individual transactions
+        return member_ids or [user_id]
+
+
+@lru_cache(maxsize=1)
+def get_report_agent() -> ReportAgent:
+    """Return the process-wide ReportAgent.
+    
+    The agent holds no per-request state (db, user and message are passed to
+    each call), so it is built once instead of on every report.
+    """
+    return ReportAgent()
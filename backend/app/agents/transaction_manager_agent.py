@@ -1,21 +1,119 @@
 from typing import Dict, Any, List, Optional
+from collections import OrderedDict
 from sqlalchemy.orm import Session
 from app.core.llm_config import get_openai_config
-from crewai import Agent, Task, Crew
 from app.services.transaction_service import TransactionService
 from app.services.user_service import UserService
 from app.models.transaction import TransactionType
-import json
+from app.utils.json_utils import parse_json_object
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+# Patterns to match numbers referring to transactions, tried in order
+# A bare number elsewhere in the message is usually an amount ("cambiar gasto a ₡6000",
+# "cambiar almuerzo a 5"), so only numbers directly introduced by one of these words
+# count, or a reply that is nothing but a number; the trailing lookahead skips
+# numbers like "5.000" that are amounts
+_TRANSACTION_NUMBER_PATTERNS = tuple(re.compile(pattern) for pattern in (
+    r"\b(?:gasto|transacción|transaccion|número|numero)\s+(\d+)\b(?![.,]\d)",  # "gasto 2", "transacción 3", "número 1"
+    r"\b(?:eliminar|borrar|editar|cambiar)\s+(?:el\s+)?(?:gasto\s+)?(\d+)\b(?![.,]\d)",  # "eliminar 2", "borrar el 2", "eliminar gasto 2"
+    r"\bel\s+(\d+)\b(?![.,]\d)",  # "el 2"
+    r"^\s*(\d+)\s*$"  # A reply that is only the list number ("3")
+))
+# Display symbol and name per transaction type
+TYPE_SYMBOLS = {TransactionType.expense: "💸", TransactionType.income: "💰"}
+TYPE_NAMES = {TransactionType.expense: "gasto", TransactionType.income: "ingreso"}
+
+# Keywords that route a message to transaction management, matched as substrings
+MANAGEMENT_KEYWORDS = (
+    "eliminar", "borrar", "quitar", "delete", "remove",
+    "editar", "cambiar", "modificar", "edit", "change", "update",
+    "últimos gastos", "transacciones recientes", "últimos movimientos",
+    "mis gastos recientes", "ver gastos", "listar gastos"
+)
+_MANAGEMENT_RE = re.compile("|".join(map(re.escape, MANAGEMENT_KEYWORDS)), re.IGNORECASE)
+
+_AMOUNT_RE = re.compile(r'(\d+(?:\.\d+)?)')
+# Static instructions first and per-request values last, so the prompt prefix
+# is identical across requests and provider-side prompt caching can reuse it
+TRANSACTION_TASK_TEMPLATE = """El usuario quiere gestionar sus transacciones.
+
+ANALIZA QUE QUIERE HACER:
+
+1. MOSTRAR TRANSACCIONES RECIENTES:
+   - "mis últimos gastos", "ver transacciones", "transacciones recientes"
+   - Acción: "list_recent"
+
+2. ELIMINAR TRANSACCIÓN:
+   - "eliminar último gasto", "borrar gasto de almuerzo", "quitar el de ₡5000"
+   - Acción: "delete" + transaction_id si es específico
+   - Si no es específico, mostrar lista para elegir
+
+3. EDITAR TRANSACCIÓN:
+   - "cambiar último gasto a ₡6000", "editar gasto de almuerzo"
+   - Acción: "edit" + transaction_id + nuevos datos
+   - Si no es específico, mostrar lista para elegir
+
+RESPONDE EN JSON:
+{{
+    "action": "list_recent|delete|edit",
+    "transaction_id": "id_si_específico_o_null",
+    "new_amount": "nuevo_monto_si_aplica",
+    "new_description": "nueva_descripción_si_aplica",
+    "confidence": "alta|media|baja"
+}}
+
+SOLICITUD DEL USUARIO: "{message}"
+
+TRANSACCIONES RECIENTES:
+{transactions_info}
+
+USUARIO ID: {user_id}"""
+
+# AI analyses, keyed by everything the prompt is built from, so a repeated
+# command over the same recent transactions skips the LLM round-trip
+_ANALYSIS_CACHE_MAX = 256
+_analysis_cache: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+
+
+def _get_cached_analysis(key: tuple) -> Optional[Dict[str, Any]]:
+    """Return a cached AI analysis for the same request and transactions, if any."""
+    analysis = _analysis_cache.get(key)
+    if analysis is not None:
+        try:
+            _analysis_cache.move_to_end(key)
+        except KeyError:
+            pass  # Evicted concurrently, the analysis itself is still valid to return
+    return analysis
+
+
+def _cache_analysis(key: tuple, analysis: Dict[str, Any]) -> None:
+    """Store an AI analysis, evicting the least recently used beyond the size limit."""
+    _analysis_cache[key] = analysis
+    _analysis_cache.move_to_end(key)
+    while len(_analysis_cache) > _ANALYSIS_CACHE_MAX:
+        _analysis_cache.popitem(last=False)
+
 
 class TransactionManagerAgent:
     """Agent for managing transactions: delete, edit, and list recent transactions."""
     
     def __init__(self):
-        try:
-            self.has_openai = get_openai_config()
-            
-            if self.has_openai:
-                self.agent = Agent(
+        self.has_openai = get_openai_config()
+        # Built on first AI use, so importing crewai and creating the Agent
+        # is skipped for processes that never manage transactions
+        self._agent = None
+    
+    @property
+    def agent(self):
+        """The CrewAI agent, created on first access when OpenAI is configured."""
+        if self._agent is None and self.has_openai:
+            try:
+                from crewai import Agent
+                
+                self._agent = Agent(
                     role="Transaction Manager Assistant",
                     goal="Help users delete, edit, and manage their transactions through natural conversation in Spanish.",
                     backstory="""Eres un asistente especializado en gestión de transacciones financieras.
@@ -45,25 +143,14 @@ class TransactionManagerAgent:
                     verbose=True,
                     allow_delegation=False
                 )
-            else:
-                self.agent = None
-                
-        except Exception as e:
-            print(f"Warning: Failed to initialize TransactionManagerAgent: {e}")
-            self.has_openai = False
-            self.agent = None
+            except Exception as e:
+                logger.warning("Failed to initialize TransactionManagerAgent: %s", e)
+                self.has_openai = False
+        return self._agent
     
     def is_transaction_management_request(self, message: str) -> bool:
         """Detect if message is about managing transactions."""
-        keywords = [
-            "eliminar", "borrar", "quitar", "delete", "remove",
-            "editar", "cambiar", "modificar", "edit", "change", "update",
-            "últimos gastos", "transacciones recientes", "últimos movimientos",
-            "mis gastos recientes", "ver gastos", "listar gastos"
-        ]
-        
-        message_lower = message.lower()
-        return any(keyword in message_lower for keyword in keywords)
+        return _MANAGEMENT_RE.search(message) is not None
     
     def handle_transaction_management(self, message: str, user_id: str, db: Session) -> Dict[str, Any]:
         """Handle transaction management requests."""
@@ -75,49 +162,37 @@ class TransactionManagerAgent:
     
     def _ai_handle_transaction_management(self, message: str, user_id: str, db: Session) -> Dict[str, Any]:
         """Use AI to understand and process transaction management requests."""
+        recent_transactions = None
         try:
             # Get recent transactions
-            recent_transactions = TransactionService.get_user_transactions(
-                db, user_id, skip=0, limit=10
-            )
+            recent_transactions = TransactionService.get_recent_user_transactions(db, user_id, limit=10)
+            
+            # "eliminar 3" / "borrar gasto 2" always deletes that list entry whatever
+            # the AI answers (see _execute_transaction_action), so skip asking it
+            if self._is_delete_by_number(message, recent_transactions):
+                return self._execute_transaction_action(
+                    {"action": "delete"}, message, user_id, db, recent_transactions
+                )
             
             # Format transactions for AI
             transactions_info = self._format_transactions_for_ai(recent_transactions)
             
+            # The listed transactions change with every add, edit or delete,
+            # so a cached analysis never outlives the data it was made from.
+            # The message keeps its case: new descriptions are copied from it.
+            cache_key = (str(user_id), message.strip(), transactions_info)
+            analysis = _get_cached_analysis(cache_key)
+            if analysis is not None:
+                return self._execute_transaction_action(analysis, message, user_id, db, recent_transactions)
+            
+            from crewai import Task, Crew
+            
             task = Task(
-                description=f"""
-                El usuario quiere gestionar sus transacciones: "{message}"
-                
-                TRANSACCIONES RECIENTES:
-                {transactions_info}
-                
-                USUARIO ID: {user_id}
-                
-                ANALIZA QUE QUIERE HACER:
-                
-                1. MOSTRAR TRANSACCIONES RECIENTES:
-                   - "mis últimos gastos", "ver transacciones", "transacciones recientes"
-                   - Acción: "list_recent"
-                
-                2. ELIMINAR TRANSACCIÓN:
-                   - "eliminar último gasto", "borrar gasto de almuerzo", "quitar el de ₡5000"
-                   - Acción: "delete" + transaction_id si es específico
-                   - Si no es específico, mostrar lista para elegir
-                
-                3. EDITAR TRANSACCIÓN:
-                   - "cambiar último gasto a ₡6000", "editar gasto de almuerzo"
-                   - Acción: "edit" + transaction_id + nuevos datos
-                   - Si no es específico, mostrar lista para elegir
-                
-                RESPONDE EN JSON:
-                {{
-                    "action": "list_recent|delete|edit",
-                    "transaction_id": "id_si_específico_o_null",
-                    "new_amount": "nuevo_monto_si_aplica",
-                    "new_description": "nueva_descripción_si_aplica",
-                    "confidence": "alta|media|baja"
-                }}
-                """,
+                description=TRANSACTION_TASK_TEMPLATE.format(
+                    message=message,
+                    transactions_info=transactions_info,
+                    user_id=user_id
+                ),
                 agent=self.agent,
                 expected_output="JSON con la acción a realizar"
             )
@@ -126,22 +201,18 @@ class TransactionManagerAgent:
             result = str(crew.kickoff()).strip()
             
             # Parse AI response
-            try:
-                # Extract JSON from response
-                import re
-                json_match = re.search(r'\{.*\}', result, re.DOTALL)
-                if json_match:
-                    analysis = json.loads(json_match.group(0))
-                else:
-                    analysis = json.loads(result)
-            except:
+            analysis = parse_json_object(result)
+            if analysis is None:
                 analysis = {"action": "list_recent", "confidence": "baja"}
+            else:
+                _cache_analysis(cache_key, analysis)
             
             return self._execute_transaction_action(analysis, message, user_id, db, recent_transactions)
             
-        except Exception as e:
-            print(f"Error in AI transaction management: {e}")
-            return self._fallback_handle_transaction_management(message, user_id, db)
+        except Exception:
+            logger.exception("Error in AI transaction management")
+            # Reuse the transactions already loaded, if the failure came after that
+            return self._fallback_handle_transaction_management(message, user_id, db, recent_transactions)
     
     def _execute_transaction_action(self, analysis: Dict, original_message: str, user_id: str, 
                                    db: Session, transactions: List) -> Dict[str, Any]:
@@ -149,13 +220,16 @@ class TransactionManagerAgent:
         action = analysis.get("action", "list_recent")
         
         # Check if user is referring to a number in the list (e.g., "gasto 2", "eliminar 3")
-        transaction_index = self._extract_transaction_number(original_message)
-        print(f"🔍 Extracted transaction index: {transaction_index} from message: '{original_message}'")
+        transaction_index = self._extract_transaction_number(original_message, len(transactions))
+        logger.debug("Extracted transaction index %s from message %r", transaction_index, original_message)
         
-        if transaction_index is not None and 1 <= transaction_index <= len(transactions):
+        if transaction_index is not None:
             selected_transaction = transactions[transaction_index - 1]  # Convert to 0-based index
             transaction_id = str(selected_transaction.id)
-            print(f"🎯 Selected transaction: {transaction_id} (index {transaction_index}, amount: ₡{selected_transaction.amount})")
+            logger.debug(
+                "Selected transaction %s (index %d, amount %s)",
+                transaction_id, transaction_index, selected_transaction.amount
+            )
             
             if action == "delete" or any(word in original_message.lower() for word in ["eliminar", "borrar"]):
                 return self._delete_specific_transaction(transaction_id, user_id, db)
@@ -189,25 +263,27 @@ class TransactionManagerAgent:
         else:
             return self._show_recent_transactions(transactions, user_id)
     
-    def _extract_transaction_number(self, message: str) -> Optional[int]:
-        """Extract transaction number from message like 'eliminar gasto 2' or 'cambiar 3'."""
-        import re
+    def _is_delete_by_number(self, message: str, transactions: List) -> bool:
+        """Check for a delete command naming a valid entry of the recent transactions list."""
+        message_lower = message.lower()
+        if "eliminar" not in message_lower and "borrar" not in message_lower:
+            return False
+        return self._extract_transaction_number(message, len(transactions)) is not None
+    
+    def _extract_transaction_number(self, message: str, transaction_count: int) -> Optional[int]:
+        """Extract transaction number from message like 'eliminar gasto 2' or 'cambiar 3'.
         
-        # Patterns to match numbers referring to transactions
-        patterns = [
-            r"(?:gasto|transacción|transaccion)\s+(\d+)",  # "gasto 2", "transacción 3"
-            r"(?:eliminar|borrar|editar|cambiar)\s+(?:gasto\s+)?(\d+)",  # "eliminar 2", "eliminar gasto 2"
-            r"(?:el\s+)?(\d+)(?:\s*$)",  # Just a number at the end
-            r"\b(\d+)\b"  # Any single digit in the message
-        ]
+        Returns None unless the number names an entry of a list of transaction_count rows.
+        """
+        message_lower = message.lower()
         
-        for pattern in patterns:
-            match = re.search(pattern, message.lower())
+        for pattern in _TRANSACTION_NUMBER_PATTERNS:
+            match = pattern.search(message_lower)
             if match:
-                try:
-                    return int(match.group(1))
-                except (ValueError, IndexError):
-                    continue
+                transaction_index = int(match.group(1))
+                if 1 <= transaction_index <= transaction_count:
+                    return transaction_index
+                return None
         
         return None
     
@@ -216,12 +292,19 @@ class TransactionManagerAgent:
         if not transactions:
             return "No hay transacciones recientes"
         
-        formatted = []
-        for i, t in enumerate(transactions[:5], 1):
-            type_symbol = "💸" if t.type == TransactionType.expense else "💰"
-            formatted.append(f"{i}. ID:{str(t.id)[:8]} | {t.date} | {type_symbol} ₡{t.amount:,.0f} | {t.description}")
-        
-        return "\n".join(formatted)
+        # The AI gets the short ID and the full timestamp to tell entries apart
+        return "\n".join(
+            self._format_transaction_line(i, t, show_id=True, date_format=None)
+            for i, t in enumerate(transactions[:5], 1)
+        )
+    
+    def _format_transaction_line(self, index: int, transaction, show_id: bool = False,
+                                 date_format: Optional[str] = "%d/%m") -> str:
+        """Format one numbered transaction row; date_format=None keeps the full timestamp."""
+        type_symbol = TYPE_SYMBOLS[transaction.type]
+        date_str = transaction.date.strftime(date_format) if date_format else transaction.date
+        id_prefix = f"ID:{str(transaction.id)[:8]} | " if show_id else ""
+        return f"{index}. {id_prefix}{date_str} | {type_symbol} ₡{transaction.amount:,.0f} | {transaction.description}"
     
     def _show_recent_transactions(self, transactions: List, user_id: str) -> Dict[str, Any]:
         """Show recent transactions to user."""
@@ -231,17 +314,16 @@ class TransactionManagerAgent:
                 "message": "📊 No tienes transacciones registradas aún.\n\n💡 Registra tu primer gasto con: 'Gasté ₡5000 en almuerzo'"
             }
         
-        message = "📊 **Tus Últimas Transacciones:**\n\n"
-        
-        for i, t in enumerate(transactions[:10], 1):
-            type_symbol = "💸" if t.type == TransactionType.expense else "💰"
-            date_str = t.date.strftime("%d/%m")
-            message += f"{i}. {date_str} | {type_symbol} ₡{t.amount:,.0f} | {t.description}\n"
-        
-        message += "\n💡 **Para gestionar:**\n"
-        message += "• 'Eliminar gasto 3' (número de la lista)\n"
-        message += "• 'Cambiar gasto 2 a ₡8000'\n"
-        message += "• 'Borrar último gasto'"
+        transaction_lines = "\n".join(
+            self._format_transaction_line(i, t) for i, t in enumerate(transactions[:10], 1)
+        )
+        message = (
+            f"📊 **Tus Últimas Transacciones:**\n\n{transaction_lines}\n\n"
+            "💡 **Para gestionar:**\n"
+            "• 'Eliminar gasto 3' (número de la lista)\n"
+            "• 'Cambiar gasto 2 a ₡8000'\n"
+            "• 'Borrar último gasto'"
+        )
         
         return {
             "success": True,
@@ -256,14 +338,13 @@ class TransactionManagerAgent:
                 "message": "📊 No tienes transacciones para eliminar."
             }
         
-        message = "🗑️ **¿Cuál gasto quieres eliminar?**\n\n"
-        
-        for i, t in enumerate(transactions[:5], 1):
-            type_symbol = "💸" if t.type == TransactionType.expense else "💰"
-            date_str = t.date.strftime("%d/%m")
-            message += f"{i}. {date_str} | {type_symbol} ₡{t.amount:,.0f} | {t.description}\n"
-        
-        message += "\n💡 Responde con el número (ej: '3') o 'cancelar'"
+        transaction_lines = "\n".join(
+            self._format_transaction_line(i, t) for i, t in enumerate(transactions[:5], 1)
+        )
+        message = (
+            f"🗑️ **¿Cuál gasto quieres eliminar?**\n\n{transaction_lines}\n\n"
+            "💡 Responde con el número (ej: '3') o 'cancelar'"
+        )
         
         return {
             "success": True,
@@ -281,14 +362,13 @@ class TransactionManagerAgent:
                 "message": "📊 No tienes transacciones para editar."
             }
         
-        message = "✏️ **¿Cuál gasto quieres editar?**\n\n"
-        
-        for i, t in enumerate(transactions[:5], 1):
-            type_symbol = "💸" if t.type == TransactionType.expense else "💰"
-            date_str = t.date.strftime("%d/%m")
-            message += f"{i}. {date_str} | {type_symbol} ₡{t.amount:,.0f} | {t.description}\n"
-        
-        message += "\n💡 Responde con el número (ej: '2') o 'cancelar'"
+        transaction_lines = "\n".join(
+            self._format_transaction_line(i, t) for i, t in enumerate(transactions[:5], 1)
+        )
+        message = (
+            f"✏️ **¿Cuál gasto quieres editar?**\n\n{transaction_lines}\n\n"
+            "💡 Responde con el número (ej: '2') o 'cancelar'"
+        )
         
         return {
             "success": True,
@@ -301,43 +381,26 @@ class TransactionManagerAgent:
     def _delete_specific_transaction(self, transaction_id: str, user_id: str, db: Session) -> Dict[str, Any]:
         """Delete a specific transaction."""
         try:
-            print(f"🗑️ Attempting to delete transaction: {transaction_id} for user: {user_id}")
+            logger.debug("Deleting transaction %s for user %s", transaction_id, user_id)
             
-            # Verify ownership
-            transaction = TransactionService.get_transaction(db, transaction_id)
-            print(f"🔍 Found transaction: {transaction is not None}")
+            # Delete only if the user owns it; ownership is checked by the same statement
+            transaction = TransactionService.delete_user_transaction(db, transaction_id, user_id)
             
             if not transaction:
-                print(f"❌ Transaction not found: {transaction_id}")
+                logger.debug("Transaction %s not found for user %s", transaction_id, user_id)
                 return {
                     "success": False,
                     "message": "❌ No se encontró esa transacción."
                 }
-                
-            if str(transaction.user_id) != user_id:
-                print(f"❌ User {user_id} doesn't own transaction owned by {transaction.user_id}")
-                return {
-                    "success": False,
-                    "message": "❌ No tienes permisos para eliminar esa transacción."
-                }
-            
-            # Delete transaction
-            success = TransactionService.delete_transaction(db, transaction_id)
             
-            if success:
-                type_text = "gasto" if transaction.type == TransactionType.expense else "ingreso"
-                return {
-                    "success": True,
-                    "message": f"✅ {type_text.capitalize()} eliminado: ₡{transaction.amount:,.0f} - {transaction.description}"
-                }
-            else:
-                return {
-                    "success": False,
-                    "message": "❌ No se pudo eliminar la transacción. Intenta de nuevo."
-                }
+            type_text = TYPE_NAMES[transaction.type]
+            return {
+                "success": True,
+                "message": f"✅ {type_text.capitalize()} eliminado: ₡{transaction.amount:,.0f} - {transaction.description}"
+            }
                 
-        except Exception as e:
-            print(f"Error deleting transaction: {e}")
+        except Exception:
+            logger.exception("Error deleting transaction")
             return {
                 "success": False,
                 "message": "❌ Error eliminando la transacción."
@@ -347,27 +410,19 @@ class TransactionManagerAgent:
                                  new_amount: Optional[str], new_description: Optional[str]) -> Dict[str, Any]:
         """Edit a specific transaction."""
         try:
-            # Verify ownership
-            transaction = TransactionService.get_transaction(db, transaction_id)
-            if not transaction or str(transaction.user_id) != user_id:
-                return {
-                    "success": False,
-                    "message": "❌ No tienes permisos para editar esa transacción."
-                }
-            
             # Prepare updates
-            from app.core.schemas import TransactionUpdate
             updates = {}
             
             if new_amount:
-                try:
+                amount_text = str(new_amount).replace(',', '').replace('₡', '').strip()
+                if amount_text.replace('.', '', 1).isdigit():
+                    # Plain number, the usual AI answer ("6000", "6000.0")
+                    updates['amount'] = float(amount_text)
+                else:
                     # Extract numeric value
-                    import re
-                    amount_match = re.search(r'(\d+(?:\.\d+)?)', new_amount.replace(',', ''))
+                    amount_match = _AMOUNT_RE.search(amount_text)
                     if amount_match:
                         updates['amount'] = float(amount_match.group(1))
-                except:
-                    pass
             
             if new_description:
                 updates['description'] = new_description
@@ -378,12 +433,11 @@ class TransactionManagerAgent:
                     "message": "❌ No hay cambios válidos para realizar."
                 }
             
-            # Update transaction
-            transaction_update = TransactionUpdate(**updates)
-            updated_transaction = TransactionService.update_transaction(db, transaction_id, transaction_update)
+            # Update only if the user owns it; ownership is checked by the same statement
+            updated_transaction = TransactionService.update_user_transaction(db, transaction_id, user_id, updates)
             
             if updated_transaction:
-                type_text = "gasto" if updated_transaction.type == TransactionType.expense else "ingreso"
+                type_text = TYPE_NAMES[updated_transaction.type]
                 return {
                     "success": True,
                     "message": f"✅ {type_text.capitalize()} actualizado: ₡{updated_transaction.amount:,.0f} - {updated_transaction.description}"
@@ -391,24 +445,24 @@ class TransactionManagerAgent:
             else:
                 return {
                     "success": False,
-                    "message": "❌ No se pudo actualizar la transacción."
+                    "message": "❌ No tienes permisos para editar esa transacción."
                 }
                 
-        except Exception as e:
-            print(f"Error updating transaction: {e}")
+        except Exception:
+            logger.exception("Error updating transaction")
             return {
                 "success": False,
                 "message": "❌ Error actualizando la transacción."
             }
     
-    def _fallback_handle_transaction_management(self, message: str, user_id: str, db: Session) -> Dict[str, Any]:
+    def _fallback_handle_transaction_management(self, message: str, user_id: str, db: Session,
+                                               recent_transactions: Optional[List] = None) -> Dict[str, Any]:
         """Fallback when AI is not available."""
         message_lower = message.lower()
         
-        # Get recent transactions for any operation
-        recent_transactions = TransactionService.get_user_transactions(
-            db, user_id, skip=0, limit=10
-        )
+        # Get recent transactions for any operation, unless the caller already has them
+        if recent_transactions is None:
+            recent_transactions = TransactionService.get_recent_user_transactions(db, user_id, limit=10)
         
         if "eliminar" in message_lower or "borrar" in message_lower:
             return self._show_transactions_for_deletion(recent_transactions)
@@ -1,13 +1,392 @@
 from typing import Dict, Any, Optional, List
+from collections import OrderedDict
 from dataclasses import dataclass
 from datetime import datetime, timedelta
+from functools import lru_cache
+from uuid import UUID
 from sqlalchemy.orm import Session
 from app.core.llm_config import get_openai_config
+from app.core.schemas import BudgetCreate, TransactionCreate
+from app.models.budget import BudgetPeriod, BudgetStatus
+from app.models.transaction import TransactionType
+from app.services.budget_service import BudgetService
 from app.services.conversation_state import conversation_state
+from app.services.organization_service import OrganizationService
+from app.services.transaction_service import TransactionService
+from app.services.user_service import UserService
+from app.agents.organization_agent import OrganizationAgent
+from app.agents.report_agent import get_report_agent
+from app.utils.json_utils import parse_json_object
 from crewai import Agent, Task, Crew
-import json
+import calendar
+import copy
+import logging
+import re
+import threading
 import uuid
 
+logger = logging.getLogger(__name__)
+
+# Command + context patterns that mark a message as a new intent, joined into one
+# alternation since any match is enough
+_NEW_INTENT_RE = re.compile("|".join(f"(?:{pattern})" for pattern in (
+    # Reports with context: "resumen personal", "gastos familia" 
+    r"(resumen|reporte|balance|gastos|ingresos|total|cuanto|cuánto)\s+(personal|familia|empresa|trabajo)",
+    
+    # Clear new transactions: "gasto 500", "compré algo"
+    r"(gasto|gasté|compré|pago|pagué|ingreso|ganancia)\s+\d+",
+    r"(gasto|gasté|compré|pago|pagué)\s+\w+",
+    
+    # Management commands: "crear familia", "gestionar gastos"
+    r"(crear|gestionar|administrar|configurar|ver|mostrar|listar)\s+\w+",
+    
+    # Help and navigation
+    r"(ayuda|help|opciones|menú|menu|cancelar|cancel)",
+    
+    # Standalone report commands
+    r"^(resumen|reporte|balance|estado|informe)$"
+)))
+
+# "crear familia X" and similar, capturing the organization type
+_ORGANIZATION_ACTION_PATTERNS = tuple(re.compile(pattern, re.IGNORECASE) for pattern in (
+    r"crear\s+(familia|empresa|equipo|organizacion|organización)\s*",
+    r"nueva?\s+(familia|empresa|equipo|organizacion|organización)\s*", 
+    r"agregar\s+(familia|empresa|equipo|organizacion|organización)\s*"
+))
+
+# Amount patterns, most specific first, each with the literals it needs to match
+# (None if it can match any message) so currency patterns are only scanned when relevant
+_AMOUNT_PATTERNS = tuple((re.compile(pattern), required) for pattern, required in (
+    (r"₡\s*(\d{1,3}(?:,?\d{3})*(?:\.\d{2})?)", ("₡",)),  # ₡1000 or ₡1,000.50
+    (r"\$\s*(\d{1,3}(?:,?\d{3})*(?:\.\d{2})?)", ("$",)),  # $1000 or $1,000.50
+    (r"(\d{1,3}(?:,?\d{3})*(?:\.\d{2})?)\s*(?:colones?|₡)", ("colon", "₡")),  # 1000 colones
+    (r"(\d{1,3}(?:,?\d{3})*(?:\.\d{2})?)\s*(?:dollars?|dólares?|\$)", ("dollar", "dólar", "$")),  # 1000 dollars
+    (r"(\d{4,})", None),  # Just numbers with 4+ digits (likely amounts)
+    (r"(\d{1,3}(?:,\d{3})+)", None),  # Numbers with comma separators
+    (r"(\d+(?:\.\d+)?)", None)  # Any number as last resort
+))
+
+# Expense verbs stripped from the front of a description
+_EXPENSE_ACTION_PATTERNS = tuple(re.compile(pattern, re.IGNORECASE) for pattern in (
+    r"gasté\s+", r"gaste\s+", r"pagué\s+", r"pague\s+", 
+    r"compré\s+", r"compre\s+", r"gasto\s+", r"agregar\s+gasto\s+",
+    r"pago\s+", r"compra\s+", r"costo\s+", r"costó\s+", r"invertí\s+", r"invirtí\s+"
+))
+# Amount words left out of descriptions: plain numbers ("40000", "12.5") or currency-prefixed ("₡500")
+_AMOUNT_WORD_RE = re.compile(r'^(?:\d+(?:\.\d+)?$|[₡\$]\d+)')
+_LEADING_PREPOSITION_RE = re.compile(r"^\s*(en|de|para|del|de\s+la|de\s+los|de\s+las)\s+", re.IGNORECASE)
+
+# Replies that pick an organization for a pending expense rather than start a new intent
+_SIMPLE_ORG_SELECTIONS = frozenset({
+    "1", "2", "3", "4", "5",  # Numbers
+    "personal", "mío", "mio", "propio",  # Personal variations
+    "mi hogar", "familia", "empresa", "trabajo"  # Simple org names
+})
+_PERSONAL_ALIASES = frozenset({"personal", "mío", "mio", "propio"})
+_PERSONAL_SELECTION_ALIASES = _PERSONAL_ALIASES | {"yo"}
+_CURRENCY_TOKENS = frozenset({"₡", "$", "colones", "colón", "dollars", "dólares"})
+
+# Messages that are exactly a help request
+_HELP_COMMANDS = frozenset({"ayuda", "help", "comandos", "qué puedo hacer", "que puedo hacer"})
+
+# Intent types the AI may return (guardrail in _validate_ai_response)
+_VALID_INTENT_TYPES = frozenset({
+    "add_expense", "create_budget", "create_organization", 
+    "view_report", "list_organizations", "manage_transactions",
+    "accept_invitation", "help", "unknown"
+})
+
+# Prompt for AI organization selection, built once; per-call values are filled with .format()
+ORG_SELECTION_TASK_TEMPLATE = """El usuario está seleccionando dónde registrar un gasto. Analiza su respuesta:
+
+MENSAJE DEL USUARIO: "{message}"
+
+OPCIONES DISPONIBLES:
+{org_context}
+{personal_option}
+
+REGLAS CRÍTICAS:
+1. "Personal" o "personal" SIEMPRE = cuenta personal (organizacion_id: null)
+2. "14" = Personal (porque 14 es la última opción Personal)
+3. Números 1-13 = organizaciones específicas
+4. Nombres de organizaciones = buscar coincidencia
+
+EJEMPLOS DE RESPUESTAS:
+- "Personal" → organizacion_id: null, organizacion_nombre: "Personal"
+- "personal" → organizacion_id: null, organizacion_nombre: "Personal"  
+- "14" → organizacion_id: null, organizacion_nombre: "Personal"
+- "1" → organizacion_id: "{first_org_id}", organizacion_nombre: "{first_org_name}"
+- "gymgo" → buscar organización que contenga "gymgo"
+- "familia" → buscar organización que contenga "familia"
+
+IMPORTANTE: "Personal" NO es una organización, es la cuenta personal del usuario.
+
+RESPONDE SOLO JSON:
+{{
+    "organizacion_id": "id_de_organizacion_o_null",
+    "organizacion_nombre": "nombre_exacto",
+    "confianza": 0.9
+}}
+"""
+
+# AI intent analyses, reused when the exact same prompt inputs come back
+_INTENT_CACHE_TTL = timedelta(minutes=10)
+_INTENT_CACHE_MAX = 2048
+_intent_cache: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+
+
+def _get_cached_intent(key: tuple) -> Optional[Dict[str, Any]]:
+    """Return a copy of a cached intent if it exists and hasn't expired."""
+    entry = _intent_cache.get(key)
+    if entry is None:
+        return None
+    if datetime.now() > entry["expires_at"]:
+        _intent_cache.pop(key, None)
+        return None
+    try:
+        _intent_cache.move_to_end(key)
+    except KeyError:
+        pass  # Evicted concurrently, the entry itself is still valid to return
+    # Callers adjust the intent in place (e.g. forcing a continuation)
+    return copy.deepcopy(entry["intent"])
+
+
+def _cache_intent(key: tuple, intent: Dict[str, Any]) -> None:
+    """Store a validated AI intent for a short time."""
+    _intent_cache[key] = {
+        "intent": copy.deepcopy(intent),
+        "expires_at": datetime.now() + _INTENT_CACHE_TTL
+    }
+    _intent_cache.move_to_end(key)
+    # Evict least recently used intents beyond the size limit
+    while len(_intent_cache) > _INTENT_CACHE_MAX:
+        _intent_cache.popitem(last=False)
+
+
+# Keyword → category for explicit categories in a message
+_CATEGORY_MAP = {
+    "comida": "Comida", "comidas": "Comida", "almuerzo": "Comida", "cena": "Comida",
+    "gasolina": "Gasolina", "combustible": "Gasolina", "diesel": "Gasolina",
+    "entretenimiento": "Entretenimiento", "diversión": "Entretenimiento", "cine": "Entretenimiento",
+    "casa": "Casa", "hogar": "Casa", "vivienda": "Casa",
+    "salud": "Salud", "medicina": "Salud", "doctor": "Salud",
+    "trabajo": "Trabajo", "oficina": "Trabajo",
+    "transporte": "Transporte", "uber": "Transporte", "taxi": "Transporte",
+    "ropa": "Ropa", "vestimenta": "Ropa"
+}
+
+# Category → keywords for categorizing expense descriptions
+_CATEGORY_KEYWORDS = {
+    "Comida": ["almuerzo", "cena", "desayuno", "comida", "restaurante", "café", "pizza"],
+    "Gasolina": ["gasolina", "combustible", "diesel", "gas"],
+    "Transporte": ["uber", "taxi", "bus", "transporte", "viaje"],
+    "Entretenimiento": ["cine", "película", "juego", "diversión", "entretenimiento"],
+    "Casa": ["casa", "hogar", "supermercado", "mercado", "tienda"],
+    "Salud": ["medicina", "doctor", "farmacia", "salud", "hospital"],
+    "Trabajo": ["oficina", "trabajo", "materiales"],
+    "Ropa": ["ropa", "zapatos", "vestido", "camisa"]
+}
+
+
+def _category_scanner(category_keywords: Dict[str, List[str]]) -> tuple:
+    """Compile category → keywords into one lookahead pattern plus category priorities.
+    
+    Every position is tried once and names the highest priority category whose
+    keyword starts there, so a single pass finds all categories in the text.
+    """
+    pattern = re.compile("(?=" + "|".join(
+        f"(?P<{category}>{'|'.join(map(re.escape, keywords))})"
+        for category, keywords in category_keywords.items()
+    ) + ")")
+    priority = {category: index for index, category in enumerate(category_keywords)}
+    return pattern, priority
+
+
+def _first_category(scanner: tuple, text: str) -> Optional[str]:
+    """Return the first category in table order with a keyword found in text."""
+    pattern, priority = scanner
+    found = {match.lastgroup for match in pattern.finditer(text)}
+    if not found:
+        return None
+    return min(found, key=priority.__getitem__)
+
+
+_MESSAGE_CATEGORY_KEYWORDS: Dict[str, List[str]] = {}
+for _keyword, _category in _CATEGORY_MAP.items():
+    _MESSAGE_CATEGORY_KEYWORDS.setdefault(_category, []).append(_keyword)
+_MESSAGE_CATEGORY_SCANNER = _category_scanner(_MESSAGE_CATEGORY_KEYWORDS)
+_DESCRIPTION_CATEGORY_SCANNER = _category_scanner(_CATEGORY_KEYWORDS)
+
+
+@lru_cache(maxsize=2048)
+def _category_for_message(message_lower: str) -> Optional[str]:
+    """Extract an explicit category from a lowercased message.
+    
+    Users repeat the same short expenses, so results are memoized per message.
+    """
+    category = _first_category(_MESSAGE_CATEGORY_SCANNER, message_lower)
+    if category:
+        return category
+    
+    # Check if "para" is used
+    if " para " in message_lower:
+        parts = message_lower.split(" para ")
+        if len(parts) > 1:
+            category_text = parts[1].strip().title()
+            return category_text
+    
+    return None
+
+
+@lru_cache(maxsize=2048)
+def _category_for_description(description_lower: str) -> str:
+    """Categorize a lowercased expense description, memoized per description."""
+    return _first_category(_DESCRIPTION_CATEGORY_SCANNER, description_lower) or "General"
+
+
+# Pure functions of the raw message, memoized since users repeat the same short messages
+@lru_cache(maxsize=4096)
+def _amount_in_message(message: str) -> Optional[float]:
+    """Extract the amount from a message"""
+    
+    # Find numbers with various patterns
+    for pattern, required in _AMOUNT_PATTERNS:
+        if required and not any(literal in message for literal in required):
+            continue
+        matches = pattern.findall(message)
+        if matches:
+            try:
+                # Take the largest number found (most likely to be the amount)
+                amounts = []
+                for match in matches:
+                    clean_amount = match.replace(',', '')
+                    amount = float(clean_amount)
+                    if amount > 0:
+                        amounts.append(amount)
+                
+                if amounts:
+                    # Return the largest amount found
+                    return max(amounts)
+            except:
+                continue
+    
+    return None
+
+
+@lru_cache(maxsize=4096)
+def _description_in_message(message: str) -> Optional[str]:
+    """Extract the description from an expense message"""
+    
+    # Remove action words more carefully
+    clean_message = message
+    for pattern in _EXPENSE_ACTION_PATTERNS:
+        clean_message = pattern.sub("", clean_message, count=1)
+    
+    # For patterns like "Gasto familia gasolina 40000", extract the middle part
+    # Split by spaces and remove numbers
+    # Skip amounts (numbers, with or without currency symbol) and currency words
+    description_words = [
+        word for word in clean_message.split()
+        if not _AMOUNT_WORD_RE.match(word) and word.lower() not in _CURRENCY_TOKENS
+    ]
+    
+    # Join the remaining words (split() already dropped surrounding whitespace)
+    description = ' '.join(description_words)
+    
+    # Remove prepositions that might remain at the start
+    description = _LEADING_PREPOSITION_RE.sub("", description)
+    
+    # Clean up spaces and punctuation
+    description = description.strip(" ,")
+    
+    # If description is reasonable length, return it
+    if len(description) > 1 and len(description) < 100:
+        return description
+    
+    return None
+
+
+# Fixed parts of the "mis gastos" listing
+_TRANSACTION_LIST_HEADER = "📝 **Tus últimos gastos:**\n"
+_TRANSACTION_LIST_FOOTER = "\n".join([
+    "\n💡 **Para gestionar:**",
+    "• 'Eliminar último gasto' - Borrar el más reciente",
+    "• 'Cambiar gasto 1 a ₡8000' - Editar monto",
+    "• 'Eliminar gasto 2' - Borrar específico"
+])
+
+_ORGANIZATION_TYPE_EMOJI = {"family": "👨‍👩‍👧‍👦", "company": "🏢", "team": "👥"}
+_ORGANIZATION_ROLE_EMOJI = {"owner": "👑", "member": "👤"}
+
+# Static responses, copied by the handlers so callers can't change the shared dicts
+_NO_TRANSACTIONS_RESPONSE = {
+    "success": True,
+    "message": "📝 **No tienes gastos registrados**\n\n💡 Agrega tu primer gasto:\n• 'Gasté ₡5000 en almuerzo'",
+    "action": "no_transactions"
+}
+
+_NO_ORGANIZATIONS_RESPONSE = {
+    "success": True,
+    "message": "👤 **Solo tienes tu cuenta personal**\n\n💡 ¿Quieres crear una organización?\n• 'Crear familia Mi Hogar'\n• 'Crear empresa Mi Negocio'",
+    "action": "no_organizations"
+}
+
+_HELP_RESPONSE = {
+    "success": True,
+    "message": """💡 **¿Qué puedes hacer?**
+
+📊 **PRESUPUESTOS:**
+• "Crear presupuesto" - Te guío paso a paso
+• "Presupuesto de ₡100000 para comida" - Directo
+
+💸 **GASTOS:**
+• "Gasté ₡5000" - Te pregunto en qué
+• "Gasté ₡5000 en almuerzo" - Directo
+• "Gasto familia gasolina 40000" - Con contexto
+
+🔧 **GESTIONAR GASTOS:**
+• "Gestionar gastos" - Ver y editar gastos
+• "Eliminar último gasto" - Borrar el más reciente
+• "Mis últimos gastos" - Ver lista
+
+🏷️ **ORGANIZACIONES:**
+• "En qué familias estoy" - Ver tus organizaciones
+• "Mis organizaciones" - Lista completa
+• "Crear familia Mi Hogar" - Nueva familia
+
+📈 **REPORTES:**
+• "Resumen" - Ver tus gastos
+• "Balance" - ¿Cómo vas?
+
+❓ **AYUDA:**
+• "Ayuda" - Ver comandos
+• Solo escríbeme en lenguaje natural 😊""",
+    "action": "help_shown"
+}
+
+_UNCLEAR_RESPONSE = {
+    "success": False,
+    "message": "🤔 No estoy seguro qué quieres hacer\n\n💡 **Puedes probar:**\n\n📊 'Crear presupuesto'\n💸 'Gasté ₡5000'\n🏷️ 'En qué familias estoy'\n📈 'Resumen'\n❓ 'Ayuda'\n\n¿Qué te gustaría hacer?",
+    "action": "unclear_message",
+    "suggestions": [
+        "Crear presupuesto",
+        "Gasté ₡5000",
+        "En qué familias estoy",
+        "Resumen",
+        "Ayuda"
+    ]
+}
+
+
+def _transaction_context_text(tx) -> str:
+    """Organization suffix for a listed transaction: its organization, Personal, or nothing"""
+    if tx.organization:
+        return f" ({tx.organization.name})"
+    if not tx.organization_id:
+        return " (Personal)"
+    return ""
+
+
 @dataclass
 class ConversationContext:
     """Context for ongoing conversation"""
@@ -22,7 +401,12 @@ class ConversationManager:
     """Manages natural conversation flow and context"""
     
     def __init__(self):
-        self.active_sessions: Dict[str, ConversationContext] = {}
+        # Ordered from least to most recently used, so expired sessions sit at the front
+        self.active_sessions: "OrderedDict[str, ConversationContext]" = OrderedDict()
+        # The async webhook runs on a single event loop and needs no lock. This guards
+        # the lookup/move_to_end/evict sequence in case the manager is later called from
+        # threads (sync FastAPI endpoints run in a threadpool)
+        self._sessions_lock = threading.Lock()
         self.session_timeout = timedelta(minutes=10)  # 10 min timeout
         
         # Initialize OpenAI agent for intelligent parsing
@@ -53,7 +437,7 @@ NUNCA inventes información que no esté en el mensaje.""",
             else:
                 self.intelligent_agent = None
         except Exception as e:
-            print(f"Warning: Could not initialize intelligent agent: {e}")
+            logger.warning("Could not initialize intelligent agent: %s", e)
             self.has_openai = False
             self.intelligent_agent = None
     
@@ -63,15 +447,20 @@ NUNCA inventes información que no esté en el mensaje.""",
         # 🔍 PRIORITY: Check for pending transaction first
         pending_transaction = conversation_state.get_pending_transaction(user_id)
         if pending_transaction:
-            print(f"💾 FOUND PENDING TRANSACTION: user={user_id}, data={pending_transaction['transaction_data']}")
+            logger.debug("Found pending transaction: user=%s, data=%s", user_id, pending_transaction["transaction_data"])
+            
+            # Normalized once for the new-intent guard and the selection fast-track
+            message_lower = message.lower().strip()
             
             # 🛡️ GUARD: Check if user wants to do something else (cancel pending transaction)
-            if self._is_clear_new_intent(message):
-                print(f"🚫 CLEAR NEW INTENT DETECTED: Clearing pending transaction for '{message}'")
+            if self._is_clear_new_intent(message_lower):
+                logger.debug("Clear new intent detected, clearing pending transaction for %r", message)
                 conversation_state.clear_pending_transaction(user_id)
                 # Continue with normal processing below
             else:
-                return self._handle_organization_selection_response(message, user_id, db, pending_transaction)
+                return self._handle_organization_selection_response(
+                    message, user_id, db, pending_transaction, message_lower=message_lower
+                )
         
         # Get or create session
         context = self._get_or_create_context(user_id)
@@ -79,10 +468,12 @@ NUNCA inventes información que no esté en el mensaje.""",
         context.last_message_time = datetime.now()
         
         # DEBUG: Log conversation state
-        print(f"🔍 CONVERSATION STATE: user={user_id}, flow={context.current_flow}, data={context.flow_data}")
+        logger.debug("Conversation state: user=%s, flow=%s, data=%s", user_id, context.current_flow, context.flow_data)
         
-        # Clean up old sessions
-        self._cleanup_old_sessions()
+        # 🚀 FAST TRACK: Plain help commands outside a flow need no intent analysis,
+        # so skip the organization query and the AI call
+        if context.current_flow == "none" and message.lower().strip() in _HELP_COMMANDS:
+            return self._show_help()
         
         # Determine if this is a new intent or continuation
         message_intent = self._analyze_message_intent(message, context, db)
@@ -95,7 +486,7 @@ NUNCA inventes información que no esté en el mensaje.""",
                 message_intent["type"] in ["help", "unknown"] or
                 len(message.strip()) < 10):  # Short messages likely continuations
                 
-                print(f"🔄 FORCING CONTINUATION: current_flow={context.current_flow}, confidence={message_intent.get('confidence')}, message='{message[:20]}...'")
+                logger.debug("Forcing continuation: current_flow=%s, confidence=%s, message=%r", context.current_flow, message_intent.get("confidence"), message[:20])
                 message_intent["is_new_flow"] = False
                 message_intent["type"] = "continuation"
         
@@ -114,7 +505,7 @@ NUNCA inventes información que no esté en el mensaje.""",
             if (len(message.strip()) <= 20 or 
                 message.strip().lower() in ["1", "2", "personal", "si", "no", "acepto"] or
                 message.strip().isdigit()):
-                print(f"🚀 FAST TRACK: Skipping AI for simple response '{message}'")
+                logger.debug("Fast track: skipping AI for simple response %r", message)
                 return {
                     "type": "unknown",
                     "confidence": 0.3,
@@ -126,7 +517,6 @@ NUNCA inventes información que no esté en el mensaje.""",
         user_organizations = []
         if db:
             try:
-                from app.services.organization_service import OrganizationService
                 user_organizations = OrganizationService.get_user_organizations(db, context.user_id)
             except:
                 user_organizations = []
@@ -150,6 +540,13 @@ NUNCA inventes información que no esté en el mensaje.""",
         if context.current_flow != "none":
             conversation_context = f"\n🧠 CONTEXT MEMORY: El usuario está en flujo '{context.current_flow}'. Sus datos pendientes: {context.flow_data}"
         
+        # Key on everything the prompt is built from. Amounts stay in the key:
+        # the cached intent carries the extracted amount and description.
+        cache_key = (message.strip(), org_context, conversation_context)
+        cached_intent = _get_cached_intent(cache_key)
+        if cached_intent is not None:
+            return cached_intent
+        
         task = Task(
             description=f"""
             TAREA: Clasifica este mensaje financiero con contexto de memoria.
@@ -206,19 +603,16 @@ NUNCA inventes información que no esté en el mensaje.""",
             )
             result = str(crew.kickoff()).strip()
             
-            print(f"🧠 ConversationManager AI Raw Result: {result}")
+            logger.debug("ConversationManager AI raw result: %s", result)
             
             # Parse AI response
-            import re
-            json_match = re.search(r'\{.*\}', result, re.DOTALL)
-            if json_match:
-                json_str = json_match.group(0)
-                intent = json.loads(json_str)
+            intent = parse_json_object(result)
+            if intent is not None:
                 
                 # GUARDRAILS: Validate AI response
                 validation_result = self._validate_ai_response(intent, message, user_organizations)
                 if not validation_result["valid"]:
-                    print(f"⚠️ GUARDRAIL TRIGGERED: {validation_result['reason']}")
+                    logger.warning("Guardrail triggered: %s", validation_result["reason"])
                     return self._regex_analyze_intent(message, context)
                 
                 # Ensure required fields exist
@@ -231,13 +625,14 @@ NUNCA inventes información que no esté en el mensaje.""",
                 if "extracted_data" not in intent:
                     intent["extracted_data"] = {}
                 
+                _cache_intent(cache_key, intent)
                 return intent
             else:
-                print(f"❌ AI response not JSON: {result}")
+                logger.warning("AI response not JSON: %s", result)
                 return self._regex_analyze_intent(message, context)
                 
-        except Exception as e:
-            print(f"❌ AI intent analysis failed: {e}")
+        except Exception:
+            logger.exception("AI intent analysis failed")
             return self._regex_analyze_intent(message, context)
     
     def _regex_analyze_intent(self, message: str, context: ConversationContext) -> Dict[str, Any]:
@@ -389,7 +784,6 @@ NUNCA inventes información que no esté en el mensaje.""",
         data["type"] = "expense"  # Default to expense for add_expense intent
         
         # Get user organizations
-        from app.services.organization_service import OrganizationService
         user_organizations = OrganizationService.get_user_organizations(db, user_id)
         
         # Check what we have
@@ -397,40 +791,42 @@ NUNCA inventes información que no esté en el mensaje.""",
         has_description = data.get("description") is not None
         organization_context = data.get("organization_context")
         
-        print(f"🔍 DEBUG: Extracted data - amount: {data.get('amount')}, description: {data.get('description')}, org_context: '{organization_context}'")
+        logger.debug("Extracted data - amount: %s, description: %s, org_context: %r", data.get("amount"), data.get("description"), organization_context)
         
         # Determine target organization
         target_organization = None
         needs_org_clarification = False
         
+        organization_context_lower = organization_context.lower() if organization_context else None
+        
         if organization_context:
             # Check if it's personal request
-            if organization_context.lower() in ["personal", "mío", "mio", "propio"]:
+            if organization_context_lower in _PERSONAL_ALIASES:
                 # User explicitly wants personal - no organization
                 data["organization_id"] = None
                 data["organization_name"] = "Personal"
                 # Skip organization clarification for personal requests
                 needs_org_clarification = False
-                print(f"🔍 DEBUG: Detected personal request, setting organization_id=None")
+                logger.debug("Detected personal request, setting organization_id=None")
             elif user_organizations:
                 # Try to match mentioned organization
                 for org in user_organizations:
-                    if organization_context.lower() in org.name.lower():
+                    if organization_context_lower in org.name.lower():
                         target_organization = org
-                        print(f"🔍 DEBUG: Matched organization: {org.name}")
+                        logger.debug("Matched organization: %s", org.name)
                         break
         
         # Check if we need to ask for organization (only if not already decided)
         if len(user_organizations) > 0:  # User has at least one organization
             if not organization_context:  # No organization mentioned at all
                 needs_org_clarification = True
-                print(f"🔍 DEBUG: No org context, needs clarification")
-            elif organization_context and not target_organization and organization_context.lower() not in ["personal", "mío", "mio", "propio"]:
+                logger.debug("No org context, needs clarification")
+            elif organization_context and not target_organization and organization_context_lower not in _PERSONAL_ALIASES:
                 # Organization mentioned but not found
                 needs_org_clarification = True
-                print(f"🔍 DEBUG: Org context '{organization_context}' not found, needs clarification")
+                logger.debug("Org context %r not found, needs clarification", organization_context)
             else:
-                print(f"🔍 DEBUG: Org context resolved, needs_clarification={needs_org_clarification}")
+                logger.debug("Org context resolved, needs_clarification=%s", needs_org_clarification)
         
         # If we have everything and organization is clear, create the expense
         if has_amount and has_description and not needs_org_clarification:
@@ -445,8 +841,8 @@ NUNCA inventes información que no esté en el mensaje.""",
         context.flow_data = data
         context.flow_data["user_organizations"] = [{"id": str(org.id), "name": org.name, "type": org.type.value} for org in user_organizations]
         
-        print(f"🔄 STARTING EXPENSE FLOW: user={user_id}, flow={context.current_flow}")
-        print(f"🔄 FLOW DATA: {context.flow_data}")
+        logger.debug("Starting expense flow: user=%s, flow=%s", user_id, context.current_flow)
+        logger.debug("Flow data: %s", context.flow_data)
         
         # If we need organization clarification first
         if needs_org_clarification and has_amount and has_description:
@@ -456,7 +852,7 @@ NUNCA inventes información que no esté en el mensaje.""",
                 transaction_data=data,
                 available_contexts=[{"id": str(org.id), "name": org.name, "type": org.type.value} for org in user_organizations]
             )
-            print(f"💾 SAVED PENDING TRANSACTION: user={user_id}, amount={data.get('amount')}")
+            logger.debug("Saved pending transaction: user=%s, amount=%s", user_id, data.get("amount"))
             return self._ask_for_organization(data, user_organizations)
         
         # If missing amount
@@ -517,12 +913,12 @@ NUNCA inventes información que no esté en el mensaje.""",
     def _handle_ongoing_conversation(self, intent: Dict, message: str, user_id: str, db: Session, context: ConversationContext) -> Dict[str, Any]:
         """Handle continuation of ongoing conversation"""
         
-        print(f"🔄 CONTINUING CONVERSATION: flow={context.current_flow}, message='{message}', is_new_flow={intent.get('is_new_flow')}")
+        logger.debug("Continuing conversation: flow=%s, message=%r, is_new_flow=%s", context.current_flow, message, intent.get("is_new_flow"))
         
         # Check if user wants to start something new (with very high confidence)
         if intent["is_new_flow"] and intent["confidence"] > 0.95:
             # Reset context and start new flow
-            print(f"🔄 HIGH CONFIDENCE NEW FLOW: resetting context")
+            logger.debug("High confidence new flow: resetting context")
             context.current_flow = "none"
             context.flow_data = {}
             return self._handle_new_conversation(intent, message, user_id, db, context)
@@ -587,9 +983,9 @@ NUNCA inventes información que no esté en el mensaje.""",
         if data.get("amount") and data.get("description") and not data.get("organization_id"):
             if len(user_organizations) >= 1:  # User has organizations (changed from > 1)
                 # Try intelligent parsing first
-                print(f"🔄 TRYING ORG SELECTION: message='{message}', orgs={len(user_organizations)}")
+                logger.debug("Trying org selection: message=%r, orgs=%d", message, len(user_organizations))
                 org_selection = self._intelligent_organization_selection(message, user_organizations, user_id, db)
-                print(f"🔄 ORG SELECTION RESULT: {org_selection}")
+                logger.debug("Org selection result: %s", org_selection)
                 if org_selection:
                     data["organization_id"] = org_selection.get("organization_id")
                     data["organization_name"] = org_selection.get("organization_name")
@@ -650,96 +1046,88 @@ NUNCA inventes información que no esté en el mensaje.""",
             "action": "expense_incomplete"
         }
     
-    def _parse_organization_selection(self, message: str, user_organizations: List) -> Optional[Dict]:
-        """Parse user's organization selection response"""
-        message_lower = message.lower().strip()
+    def _fast_parse_org(self, message_lower: str, user_organizations: List) -> Optional[Dict]:
+        """Resolve personal aliases, option numbers and exact organization names (no AI needed)"""
         
-        print(f"🔍 PARSING ORG SELECTION: message='{message_lower}', orgs={len(user_organizations)}")
+        # Handle "personal" variations
+        if message_lower in _PERSONAL_SELECTION_ALIASES:
+            logger.debug("Fast-track: personal selected")
+            return {
+                "organization_id": None,
+                "organization_name": "Personal"
+            }
         
-        # Try numeric selection first
+        # Handle numeric selection
         try:
             selection_num = int(message_lower)
-            print(f"🔍 NUMERIC SELECTION: {selection_num}")
+            logger.debug("Fast-track: numeric selection %d", selection_num)
+            
+            # Check if it's a valid organization number
             if 1 <= selection_num <= len(user_organizations):
                 org = user_organizations[selection_num - 1]
-                result = {
+                logger.debug("Fast-track: selected org %s", org["name"])
+                return {
                     "organization_id": org["id"],
                     "organization_name": org["name"]
                 }
-                print(f"🔍 MATCHED ORG: {result}")
-                return result
-            elif selection_num == len(user_organizations) + 1 or selection_num == 2:  # Added 2 for Personal
-                # Personal selection
-                result = {
+            # Check if it's the personal option (last number)
+            elif selection_num == len(user_organizations) + 1:
+                logger.debug("Fast-track: personal option selected via number")
+                return {
                     "organization_id": None,
                     "organization_name": "Personal"
                 }
-                print(f"🔍 MATCHED PERSONAL: {result}")
-                return result
         except ValueError:
             pass
         
-        # Try exact personal matching (most important)
-        if message_lower in ["personal", "2"]:
+        # For exact organization name matches
+        for org in user_organizations:
+            if org["name"].lower() == message_lower:
+                logger.debug("Fast-track: exact name match for %s", org["name"])
+                return {
+                    "organization_id": org["id"],
+                    "organization_name": org["name"]
+                }
+        
+        return None
+    
+    def _match_organization_name(self, message_lower: str, user_organizations: List) -> Optional[Dict]:
+        """Loose fallback once _fast_parse_org found nothing: "2" as Personal, then partial names"""
+        
+        # "2" is Personal even when there are no organizations to number
+        if message_lower == "2":
             result = {
                 "organization_id": None,
                 "organization_name": "Personal"
             }
-            print(f"🔍 EXACT PERSONAL MATCH: {result}")
+            logger.debug("Exact personal match: %s", result)
             return result
         
         # Try name matching
         for org in user_organizations:
-            if org["name"].lower() in message_lower or message_lower in org["name"].lower():
+            name_lower = org["name"].lower()
+            if name_lower in message_lower or message_lower in name_lower:
                 result = {
                     "organization_id": org["id"],
                     "organization_name": org["name"]
                 }
-                print(f"🔍 NAME MATCH: {result}")
+                logger.debug("Name match: %s", result)
                 return result
         
-        print(f"🔍 NO MATCH FOUND")
+        logger.debug("No organization match found")
         return None
     
-    def _is_clear_new_intent(self, message: str) -> bool:
-        """Detect if message is clearly a new intent (not organization selection)"""
-        message_lower = message.lower().strip()
+    def _is_clear_new_intent(self, message_lower: str) -> bool:
+        """Detect if a lowercased, stripped message is clearly a new intent (not organization selection)"""
         
         # 🛡️ SIMPLE ORGANIZATION SELECTIONS (do NOT cancel pending transaction)
-        simple_org_selections = [
-            "1", "2", "3", "4", "5",  # Numbers
-            "personal", "mío", "mio", "propio",  # Personal variations
-            "mi hogar", "familia", "empresa", "trabajo"  # Simple org names
-        ]
-        
         # If it's a simple org selection, it's NOT a new intent
-        if message_lower in simple_org_selections:
+        if message_lower in _SIMPLE_ORG_SELECTIONS:
             return False
         
         # 🧠 COMPLEX ANALYSIS: Check for command + context patterns
-        command_patterns = [
-            # Reports with context: "resumen personal", "gastos familia" 
-            r"(resumen|reporte|balance|gastos|ingresos|total|cuanto|cuánto)\s+(personal|familia|empresa|trabajo)",
-            
-            # Clear new transactions: "gasto 500", "compré algo"
-            r"(gasto|gasté|compré|pago|pagué|ingreso|ganancia)\s+\d+",
-            r"(gasto|gasté|compré|pago|pagué)\s+\w+",
-            
-            # Management commands: "crear familia", "gestionar gastos"
-            r"(crear|gestionar|administrar|configurar|ver|mostrar|listar)\s+\w+",
-            
-            # Help and navigation
-            r"(ayuda|help|opciones|menú|menu|cancelar|cancel)",
-            
-            # Standalone report commands
-            r"^(resumen|reporte|balance|estado|informe)$"
-        ]
-        
-        # Check complex patterns with regex
-        import re
-        for pattern in command_patterns:
-            if re.search(pattern, message_lower):
-                return True
+        if _NEW_INTENT_RE.search(message_lower):
+            return True
         
         # Check if message is too long/complex to be simple org selection
         if len(message_lower) > 20:
@@ -747,17 +1135,18 @@ NUNCA inventes información que no esté en el mensaje.""",
             
         return False
     
-    def _handle_organization_selection_response(self, message: str, user_id: str, db: Session, pending_transaction: Dict) -> Dict[str, Any]:
+    def _handle_organization_selection_response(self, message: str, user_id: str, db: Session, pending_transaction: Dict,
+                                                message_lower: Optional[str] = None) -> Dict[str, Any]:
         """Handle organization selection response for pending transaction"""
         
         transaction_data = pending_transaction["transaction_data"]
         available_contexts = pending_transaction["available_contexts"]
         
-        print(f"🔍 HANDLING ORG SELECTION: message='{message}', contexts={len(available_contexts)}")
+        logger.debug("Handling org selection: message=%r, contexts=%d", message, len(available_contexts))
         
         # Use our fast-track organization selection
         org_selection = self._intelligent_organization_selection(
-            message, available_contexts, user_id, db
+            message, available_contexts, user_id, db, message_lower=message_lower
         )
         
         if org_selection:
@@ -789,61 +1178,30 @@ NUNCA inventes información que no esté en el mensaje.""",
                 "action": "expense_need_organization"
             }
     
-    def _intelligent_organization_selection(self, message: str, user_organizations: List, user_id: str, db: Session) -> Optional[Dict]:
-        """Use AI to intelligently parse organization selection with fast-track for simple responses"""
+    def _intelligent_organization_selection(self, message: str, user_organizations: List, user_id: str, db: Session,
+                                            message_lower: Optional[str] = None) -> Optional[Dict]:
+        """Use AI to intelligently parse organization selection with fast-track for simple responses
         
-        # 🚀 FAST-TRACK: Handle simple responses directly (no CrewAI needed)
-        message_lower = message.lower().strip()
-        
-        print(f"🚀 FAST-TRACK: Checking simple response '{message_lower}'")
+        message_lower is the already lowercased, stripped message when the caller has it.
+        """
         
-        # Handle "personal" variations
-        if message_lower in ["personal", "mío", "mio", "propio", "yo"]:
-            print(f"🚀 FAST-TRACK: Personal selected")
-            return {
-                "organization_id": None,
-                "organization_name": "Personal"
-            }
+        # 🚀 FAST-TRACK: Handle simple responses directly (no CrewAI needed)
+        if message_lower is None:
+            message_lower = message.lower().strip()
         
-        # Handle numeric selection
-        try:
-            selection_num = int(message_lower)
-            print(f"🚀 FAST-TRACK: Numeric selection {selection_num}")
-            
-            # Check if it's a valid organization number
-            if 1 <= selection_num <= len(user_organizations):
-                org = user_organizations[selection_num - 1]
-                print(f"🚀 FAST-TRACK: Selected org {org['name']}")
-                return {
-                    "organization_id": org["id"],
-                    "organization_name": org["name"]
-                }
-            # Check if it's the personal option (last number)
-            elif selection_num == len(user_organizations) + 1:
-                print(f"🚀 FAST-TRACK: Personal option selected via number")
-                return {
-                    "organization_id": None,
-                    "organization_name": "Personal"
-                }
-        except ValueError:
-            pass
+        logger.debug("Fast-track: checking simple response %r", message_lower)
         
-        # For exact organization name matches
-        for org in user_organizations:
-            if org["name"].lower() == message_lower:
-                print(f"🚀 FAST-TRACK: Exact name match for {org['name']}")
-                return {
-                    "organization_id": org["id"],
-                    "organization_name": org["name"]
-                }
+        fast_selection = self._fast_parse_org(message_lower, user_organizations)
+        if fast_selection:
+            return fast_selection
         
         # 🧠 AI-POWERED: Use CrewAI only for complex/ambiguous cases
-        print(f"🧠 Using AI for complex selection: '{message}'")
+        logger.debug("Using AI for complex selection: %r", message)
         
         if self.has_openai and self.intelligent_agent:
             return self._ai_parse_organization_selection(message, user_organizations)
         else:
-            return self._parse_organization_selection(message, user_organizations)
+            return self._match_organization_name(message_lower, user_organizations)
     
     def _ai_parse_organization_selection(self, message: str, user_organizations: List) -> Optional[Dict]:
         """Use AI to parse organization selection with better understanding"""
@@ -856,41 +1214,14 @@ NUNCA inventes información que no esté en el mensaje.""",
         personal_option = f"{len(user_organizations) + 1}. Personal"
         
         try:
-            from crewai import Task, Crew
-            
             task = Task(
-                description=f"""
-                El usuario está seleccionando dónde registrar un gasto. Analiza su respuesta:
-                
-                MENSAJE DEL USUARIO: "{message}"
-                
-                OPCIONES DISPONIBLES:
-                {org_context}
-                {personal_option}
-                
-                REGLAS CRÍTICAS:
-                1. "Personal" o "personal" SIEMPRE = cuenta personal (organizacion_id: null)
-                2. "14" = Personal (porque 14 es la última opción Personal)
-                3. Números 1-13 = organizaciones específicas
-                4. Nombres de organizaciones = buscar coincidencia
-                
-                EJEMPLOS DE RESPUESTAS:
-                - "Personal" → organizacion_id: null, organizacion_nombre: "Personal"
-                - "personal" → organizacion_id: null, organizacion_nombre: "Personal"  
-                - "14" → organizacion_id: null, organizacion_nombre: "Personal"
-                - "1" → organizacion_id: "{user_organizations[0]['id']}", organizacion_nombre: "{user_organizations[0]['name']}"
-                - "gymgo" → buscar organización que contenga "gymgo"
-                - "familia" → buscar organización que contenga "familia"
-                
-                IMPORTANTE: "Personal" NO es una organización, es la cuenta personal del usuario.
-                
-                RESPONDE SOLO JSON:
-                {{
-                    "organizacion_id": "id_de_organizacion_o_null",
-                    "organizacion_nombre": "nombre_exacto",
-                    "confianza": 0.9
-                }}
-                """,
+                description=ORG_SELECTION_TASK_TEMPLATE.format(
+                    message=message,
+                    org_context=org_context,
+                    personal_option=personal_option,
+                    first_org_id=user_organizations[0]["id"],
+                    first_org_name=user_organizations[0]["name"]
+                ),
                 agent=self.intelligent_agent,
                 expected_output="JSON con la selección de organización parseada"
             )
@@ -905,12 +1236,8 @@ NUNCA inventes información que no esté en el mensaje.""",
             result = str(crew.kickoff()).strip()
             
             # Parse AI response
-            import re
-            import json
-            json_match = re.search(r'\{.*\}', result, re.DOTALL)
-            if json_match:
-                json_str = json_match.group(0)
-                parsed = json.loads(json_str)
+            parsed = parse_json_object(result)
+            if parsed is not None:
                 
                 org_id = parsed.get("organizacion_id")
                 org_name = parsed.get("organizacion_nombre", "Personal")
@@ -931,8 +1258,9 @@ NUNCA inventes información que no esté en el mensaje.""",
                         }
                 
                 # If ID not found, try name matching
+                org_name_lower = org_name.lower()
                 for org in user_organizations:
-                    if org_name.lower() in org["name"].lower():
+                    if org_name_lower in org["name"].lower():
                         return {
                             "organization_id": org["id"],
                             "organization_name": org["name"]
@@ -940,11 +1268,11 @@ NUNCA inventes información que no esté en el mensaje.""",
                 
                 return None
             
-        except Exception as e:
-            print(f"AI organization selection failed: {e}")
+        except Exception:
+            logger.exception("AI organization selection failed")
         
-        # Fallback to simple parsing
-        return self._parse_organization_selection(message, user_organizations)
+        # Fallback to simple parsing (the fast-track already ran before the AI)
+        return self._match_organization_name(message.lower().strip(), user_organizations)
     
     def _validate_ai_response(self, intent: Dict, message: str, user_organizations: List) -> Dict[str, Any]:
         """
@@ -952,17 +1280,17 @@ NUNCA inventes información que no esté en el mensaje.""",
         """
         extracted_data = intent.get("extracted_data", {})
         org_context = extracted_data.get("organization_context")
+        org_context_lower = org_context.lower() if org_context else None
+        message_lower = message.lower()
         
         # GUARDRAIL 1: No invented organizations
         if org_context and user_organizations:
-            # Check if mentioned org exists
-            org_names = [org.name.lower() for org in user_organizations]
-            if (org_context.lower() not in ["personal", "mío", "mio", "propio"] and 
-                org_context.lower() not in org_names and
-                not any(org_context.lower() in name for name in org_names)):
+            # Check if mentioned org exists (exact names are contained in themselves)
+            if (org_context_lower not in _PERSONAL_ALIASES and 
+                not any(org_context_lower in org.name.lower() for org in user_organizations)):
                 
                 # Check if it's actually mentioned in the message
-                if org_context.lower() not in message.lower():
+                if org_context_lower not in message_lower:
                     return {
                         "valid": False,
                         "reason": f"AI invented organization '{org_context}' not mentioned in message"
@@ -970,9 +1298,8 @@ NUNCA inventes información que no esté en el mensaje.""",
         
         # GUARDRAIL 2: Organization context only when explicitly mentioned
         if org_context:
-            message_lower = message.lower()
             context_mentioned = (
-                org_context.lower() in message_lower or
+                org_context_lower in message_lower or
                 any(keyword in message_lower for keyword in ["personal", "familia", "empresa", "trabajo"])
             )
             if not context_mentioned:
@@ -982,12 +1309,7 @@ NUNCA inventes información que no esté en el mensaje.""",
                 }
         
         # GUARDRAIL 3: Valid intent types
-        valid_types = [
-            "add_expense", "create_budget", "create_organization", 
-            "view_report", "list_organizations", "manage_transactions",
-            "accept_invitation", "help", "unknown"
-        ]
-        if intent.get("type") not in valid_types:
+        if intent.get("type") not in _VALID_INTENT_TYPES:
             return {
                 "valid": False,
                 "reason": f"Invalid intent type: {intent.get('type')}"
@@ -998,14 +1320,7 @@ NUNCA inventes información que no esté en el mensaje.""",
     def _create_budget_directly(self, data: Dict, user_id: str, db: Session, context: ConversationContext) -> Dict[str, Any]:
         """Create budget with all required data"""
         try:
-            from app.services.budget_service import BudgetService
-            from app.services.user_service import UserService
-            from app.core.schemas import BudgetCreate
-            from app.models.budget import BudgetPeriod, BudgetStatus
-            from datetime import datetime
-            import calendar
-            
-            user = UserService.get_user(db, user_id)
+            user_currency = UserService.get_user_currency(db, user_id)
             
             # Calculate period dates (monthly)
             start_date = datetime.now()
@@ -1033,7 +1348,7 @@ NUNCA inventes información que no esté en el mensaje.""",
             context.current_flow = "none"
             context.flow_data = {}
             
-            currency = "₡" if user and user.currency == "CRC" else "$"
+            currency = "₡" if user_currency == "CRC" else "$"
             
             return {
                 "success": True,
@@ -1053,12 +1368,7 @@ NUNCA inventes información que no esté en el mensaje.""",
     def _create_expense_directly(self, data: Dict, user_id: str, db: Session, context: ConversationContext) -> Dict[str, Any]:
         """Create expense with all required data"""
         try:
-            from app.services.transaction_service import TransactionService
-            from app.services.user_service import UserService
-            from app.core.schemas import TransactionCreate
-            from app.models.transaction import TransactionType
-            
-            user = UserService.get_user(db, user_id)
+            user_currency = UserService.get_user_currency(db, user_id)
             
             # Determine category from description
             category = self._smart_categorize(data['description'])
@@ -1071,13 +1381,12 @@ NUNCA inventes información que no esté en el mensaje.""",
             org_uuid = None
             if organization_id and organization_id != "null":
                 try:
-                    from uuid import UUID
                     org_uuid = UUID(organization_id) if isinstance(organization_id, str) else organization_id
                 except ValueError:
-                    print(f"⚠️ Invalid organization_id format: {organization_id}")
+                    logger.warning("Invalid organization_id format: %s", organization_id)
                     org_uuid = None
             
-            print(f"🔍 DEBUG: Creating expense with org_id='{org_uuid}', org_name='{organization_name}'")
+            logger.debug("Creating expense with org_id=%s, org_name=%r", org_uuid, organization_name)
             
             transaction_data = TransactionCreate(
                 user_id=UUID(user_id) if isinstance(user_id, str) else user_id,
@@ -1088,16 +1397,14 @@ NUNCA inventes información que no esté en el mensaje.""",
                 description=data['description']
             )
             
+            # Also checks budget alerts for the expense, on the same session
             transaction = TransactionService.create_transaction(db, transaction_data)
             
-            # Check budget alerts
-            self._check_budget_alerts(user_id, float(data['amount']), category, db)
-            
             # Reset conversation context
             context.current_flow = "none"
             context.flow_data = {}
             
-            currency = "₡" if user and user.currency == "CRC" else "$"
+            currency = "₡" if user_currency == "CRC" else "$"
             
             # Create context-aware confirmation message
             context_text = ""
@@ -1157,25 +1464,18 @@ NUNCA inventes información que no esté en el mensaje.""",
         data = {}
         
         # Extract organization name (after action words)
-        import re
         
         # Remove action patterns
         clean_message = message
-        action_patterns = [
-            r"crear\s+(familia|empresa|equipo|organizacion|organización)\s*",
-            r"nueva?\s+(familia|empresa|equipo|organizacion|organización)\s*", 
-            r"agregar\s+(familia|empresa|equipo|organizacion|organización)\s*"
-        ]
-        
-        for pattern in action_patterns:
-            match = re.search(pattern, clean_message, re.IGNORECASE)
+        for pattern in _ORGANIZATION_ACTION_PATTERNS:
+            match = pattern.search(clean_message)
             if match:
                 # Get organization type
                 org_type = match.group(1).lower()
                 data["organization_type"] = org_type
                 
                 # Remove the matched pattern to get the name
-                clean_message = re.sub(pattern, "", clean_message, flags=re.IGNORECASE)
+                clean_message = pattern.sub("", clean_message)
                 break
         
         # Extract name (remaining text)
@@ -1187,162 +1487,31 @@ NUNCA inventes información que no esté en el mensaje.""",
     
     def _extract_amount(self, message: str) -> Optional[float]:
         """Extract amount from message"""
-        import re
-        
-        # Find numbers with various patterns
-        patterns = [
-            r"₡\s*(\d{1,3}(?:,?\d{3})*(?:\.\d{2})?)",  # ₡1000 or ₡1,000.50
-            r"\$\s*(\d{1,3}(?:,?\d{3})*(?:\.\d{2})?)",  # $1000 or $1,000.50
-            r"(\d{1,3}(?:,?\d{3})*(?:\.\d{2})?)\s*(?:colones?|₡)",  # 1000 colones
-            r"(\d{1,3}(?:,?\d{3})*(?:\.\d{2})?)\s*(?:dollars?|dólares?|\$)",  # 1000 dollars
-            r"(\d{4,})",  # Just numbers with 4+ digits (likely amounts)
-            r"(\d{1,3}(?:,\d{3})+)",  # Numbers with comma separators
-            r"(\d+(?:\.\d+)?)"  # Any number as last resort
-        ]
-        
-        for pattern in patterns:
-            matches = re.findall(pattern, message)
-            if matches:
-                try:
-                    # Take the largest number found (most likely to be the amount)
-                    amounts = []
-                    for match in matches:
-                        clean_amount = match.replace(',', '')
-                        amount = float(clean_amount)
-                        if amount > 0:
-                            amounts.append(amount)
-                    
-                    if amounts:
-                        # Return the largest amount found
-                        return max(amounts)
-                except:
-                    continue
-        
-        return None
+        return _amount_in_message(message)
     
     def _extract_category(self, message: str) -> Optional[str]:
         """Extract category from message"""
-        message_lower = message.lower()
-        
-        category_map = {
-            "comida": "Comida", "comidas": "Comida", "almuerzo": "Comida", "cena": "Comida",
-            "gasolina": "Gasolina", "combustible": "Gasolina", "diesel": "Gasolina",
-            "entretenimiento": "Entretenimiento", "diversión": "Entretenimiento", "cine": "Entretenimiento",
-            "casa": "Casa", "hogar": "Casa", "vivienda": "Casa",
-            "salud": "Salud", "medicina": "Salud", "doctor": "Salud",
-            "trabajo": "Trabajo", "oficina": "Trabajo",
-            "transporte": "Transporte", "uber": "Transporte", "taxi": "Transporte",
-            "ropa": "Ropa", "vestimenta": "Ropa"
-        }
-        
-        for keyword, category in category_map.items():
-            if keyword in message_lower:
-                return category
-        
-        # Check if "para" is used
-        if " para " in message_lower:
-            parts = message_lower.split(" para ")
-            if len(parts) > 1:
-                category_text = parts[1].strip().title()
-                return category_text
-        
-        return None
+        return _category_for_message(message.lower())
     
     def _extract_description(self, message: str) -> Optional[str]:
         """Extract description from expense message"""
-        import re
-        
-        # Remove action words more carefully
-        clean_message = message
-        action_patterns = [
-            r"gasté\s+", r"gaste\s+", r"pagué\s+", r"pague\s+", 
-            r"compré\s+", r"compre\s+", r"gasto\s+", r"agregar\s+gasto\s+",
-            r"pago\s+", r"compra\s+", r"costo\s+", r"costó\s+", r"invertí\s+", r"invirtí\s+"
-        ]
-        
-        for pattern in action_patterns:
-            clean_message = re.sub(pattern, "", clean_message, count=1, flags=re.IGNORECASE)
-        
-        # For patterns like "Gasto familia gasolina 40000", extract the middle part
-        # Split by spaces and remove numbers
-        words = clean_message.split()
-        description_words = []
-        
-        for word in words:
-            # Skip if it's purely numeric (likely amount)
-            if re.match(r'^\d+(\.\d+)?$', word):
-                continue
-            # Skip if it's currency-related
-            if word.lower() in ['₡', '$', 'colones', 'colón', 'dollars', 'dólares']:
-                continue
-            # Skip if it's a pure number with currency symbol
-            if re.match(r'^[₡\$]\d+', word):
-                continue
-                
-            description_words.append(word)
-        
-        # Join the remaining words
-        description = ' '.join(description_words).strip()
-        
-        # Remove prepositions that might remain at the start
-        description = re.sub(r"^\s*(en|de|para|del|de\s+la|de\s+los|de\s+las)\s+", "", description, flags=re.IGNORECASE)
-        
-        # Clean up spaces and punctuation
-        description = description.strip().strip(",").strip()
-        
-        # If description is reasonable length, return it
-        if len(description) > 1 and len(description) < 100:
-            return description
-        
-        return None
+        return _description_in_message(message)
     
     def _smart_categorize(self, description: str) -> str:
         """Smart categorization of expenses"""
-        description_lower = description.lower()
-        
-        category_keywords = {
-            "Comida": ["almuerzo", "cena", "desayuno", "comida", "restaurante", "café", "pizza"],
-            "Gasolina": ["gasolina", "combustible", "diesel", "gas"],
-            "Transporte": ["uber", "taxi", "bus", "transporte", "viaje"],
-            "Entretenimiento": ["cine", "película", "juego", "diversión", "entretenimiento"],
-            "Casa": ["casa", "hogar", "supermercado", "mercado", "tienda"],
-            "Salud": ["medicina", "doctor", "farmacia", "salud", "hospital"],
-            "Trabajo": ["oficina", "trabajo", "materiales"],
-            "Ropa": ["ropa", "zapatos", "vestido", "camisa"]
-        }
-        
-        for category, keywords in category_keywords.items():
-            for keyword in keywords:
-                if keyword in description_lower:
-                    return category
-        
-        return "General"
-    
-    def _check_budget_alerts(self, user_id: str, amount: float, category: str, db: Session):
-        """Check if this expense triggers budget alerts"""
-        try:
-            from app.services.budget_service import BudgetService
-            from decimal import Decimal
-            
-            budget_service = BudgetService(db)
-            budget_service.check_budget_alerts(user_id, Decimal(str(amount)), category)
-        except Exception as e:
-            print(f"Error checking budget alerts: {e}")
+        return _category_for_description(description.lower())
     
     def _generate_report(self, message: str, user_id: str, db: Session) -> Dict[str, Any]:
         """Generate expense report"""
-        from app.agents.report_agent import ReportAgent
-        from app.services.user_service import UserService
         
-        report_agent = ReportAgent()
-        user = UserService.get_user(db, user_id)
-        currency_symbol = "₡" if user and user.currency == "CRC" else "$"
+        report_agent = get_report_agent()
+        user_currency = UserService.get_user_currency(db, user_id)
+        currency_symbol = "₡" if user_currency == "CRC" else "$"
         
         return report_agent.generate_report(message, user_id, db, currency_symbol)
     
     def _handle_organization_creation(self, intent: Dict, message: str, user_id: str, db: Session, context: ConversationContext) -> Dict[str, Any]:
         """Handle organization creation"""
-        from app.agents.organization_agent import OrganizationAgent
         
         org_agent = OrganizationAgent()
         return org_agent.process_organization_command(message, user_id, db)
@@ -1350,44 +1519,21 @@ NUNCA inventes información que no esté en el mensaje.""",
     def _handle_transaction_management(self, message: str, user_id: str, db: Session) -> Dict[str, Any]:
         """Handle transaction management requests"""
         try:
-            from app.services.transaction_service import TransactionService
-            from app.services.user_service import UserService
-            
             # Get recent transactions for the user
-            transactions = TransactionService.get_user_transactions(db, user_id, limit=10)
-            user = UserService.get_user(db, user_id)
+            transactions = TransactionService.get_user_transactions(db, user_id, limit=10, with_organization=True)
             
             if not transactions:
-                return {
-                    "success": True,
-                    "message": "📝 **No tienes gastos registrados**\n\n💡 Agrega tu primer gasto:\n• 'Gasté ₡5000 en almuerzo'",
-                    "action": "no_transactions"
-                }
+                return dict(_NO_TRANSACTIONS_RESPONSE)
             
-            currency = "₡" if user and user.currency == "CRC" else "$"
+            user_currency = UserService.get_user_currency(db, user_id)
+            currency = "₡" if user_currency == "CRC" else "$"
             
-            # Build transaction list
-            transaction_list = ["📝 **Tus últimos gastos:**\n"]
-            
-            for i, tx in enumerate(transactions[:5], 1):  # Show last 5
-                # Format amount
-                amount_text = f"{currency}{tx.amount:,.0f}"
-                
-                # Get organization context
-                org_text = ""
-                if tx.organization:
-                    org_text = f" ({tx.organization.name})"
-                elif not tx.organization_id:
-                    org_text = " (Personal)"
-                
-                transaction_list.append(f"{i}. {amount_text} - {tx.description}{org_text}")
-            
-            transaction_list.append("\n💡 **Para gestionar:**")
-            transaction_list.append("• 'Eliminar último gasto' - Borrar el más reciente")
-            transaction_list.append("• 'Cambiar gasto 1 a ₡8000' - Editar monto")
-            transaction_list.append("• 'Eliminar gasto 2' - Borrar específico")
-            
-            message = "\n".join(transaction_list)
+            # Build transaction list (last 5)
+            transaction_lines = [
+                f"{i}. {currency}{tx.amount:,.0f} - {tx.description}{_transaction_context_text(tx)}"
+                for i, tx in enumerate(transactions[:5], 1)
+            ]
+            message = "\n".join([_TRANSACTION_LIST_HEADER, *transaction_lines, _TRANSACTION_LIST_FOOTER])
             
             return {
                 "success": True,
@@ -1396,8 +1542,8 @@ NUNCA inventes información que no esté en el mensaje.""",
                 "transaction_count": len(transactions)
             }
             
-        except Exception as e:
-            print(f"Error in transaction management: {e}")
+        except Exception:
+            logger.exception("Error in transaction management")
             return {
                 "success": False,
                 "message": "❌ No pude obtener tus gastos en este momento.",
@@ -1407,42 +1553,26 @@ NUNCA inventes información que no esté en el mensaje.""",
     def _list_user_organizations(self, user_id: str, db: Session) -> Dict[str, Any]:
         """List user's organizations and memberships"""
         try:
-            from app.services.organization_service import OrganizationService
-            from app.services.user_service import UserService
-            
-            # Get user's organizations
-            user_organizations = OrganizationService.get_user_organizations(db, user_id)
-            user = UserService.get_user(db, user_id)
+            # Get user's organizations with the user's role in each (one query)
+            user_organizations = OrganizationService.get_user_organizations_with_roles(db, user_id)
             
             if not user_organizations:
-                return {
-                    "success": True,
-                    "message": "👤 **Solo tienes tu cuenta personal**\n\n💡 ¿Quieres crear una organización?\n• 'Crear familia Mi Hogar'\n• 'Crear empresa Mi Negocio'",
-                    "action": "no_organizations"
-                }
+                return dict(_NO_ORGANIZATIONS_RESPONSE)
             
             # Build organization list
-            org_list = ["🏷️ **Tus organizaciones:**\n"]
-            
-            for i, org in enumerate(user_organizations, 1):
-                # Get emoji based on type
-                if org.type.value == "family":
-                    emoji = "👨‍👩‍👧‍👦"
-                elif org.type.value == "company":
-                    emoji = "🏢" 
-                elif org.type.value == "team":
-                    emoji = "👥"
-                else:
-                    emoji = "🏷️"
-                
-                # Get role
-                membership = OrganizationService.get_user_membership(db, user_id, str(org.id))
-                role_emoji = "👑" if membership.role.value == "owner" else "👤" if membership.role.value == "member" else "👀"
-                
-                org_list.append(f"{i}. {emoji} **{org.name}** {role_emoji}")
+            org_lines = [
+                f"{i}. {_ORGANIZATION_TYPE_EMOJI.get(org.type.value, '🏷️')} **{org.name}** "
+                f"{_ORGANIZATION_ROLE_EMOJI.get(role.value, '👀')}"
+                for i, (org, role) in enumerate(user_organizations, 1)
+            ]
+            first_org = user_organizations[0][0]
             
-            org_list.append(f"\n👤 **Personal** (siempre disponible)")
-            org_list.append(f"\n💡 **Tip:** Menciona el nombre para gastos específicos:\n• 'Gasto {user_organizations[0].name.lower()} gasolina 40000'")
+            org_list = [
+                "🏷️ **Tus organizaciones:**\n",
+                *org_lines,
+                f"\n👤 **Personal** (siempre disponible)",
+                f"\n💡 **Tip:** Menciona el nombre para gastos específicos:\n• 'Gasto {first_org.name.lower()} gasolina 40000'"
+            ]
             
             message = "\n".join(org_list)
             
@@ -1453,8 +1583,8 @@ NUNCA inventes información que no esté en el mensaje.""",
                 "organization_count": len(user_organizations)
             }
             
-        except Exception as e:
-            print(f"Error listing organizations: {e}")
+        except Exception:
+            logger.exception("Error listing organizations")
             return {
                 "success": False,
                 "message": "❌ No pude obtener tus organizaciones en este momento.",
@@ -1463,86 +1593,47 @@ NUNCA inventes información que no esté en el mensaje.""",
     
     def _handle_accept_invitation(self, user_id: str, db: Session) -> Dict[str, Any]:
         """Handle invitation acceptance"""
-        from app.agents.organization_agent import OrganizationAgent
         
         org_agent = OrganizationAgent()
         return org_agent._handle_accept_invitation_natural(user_id, db)
     
     def _show_help(self) -> Dict[str, Any]:
         """Show helpful commands"""
-        return {
-            "success": True,
-            "message": """💡 **¿Qué puedes hacer?**
-
-📊 **PRESUPUESTOS:**
-• "Crear presupuesto" - Te guío paso a paso
-• "Presupuesto de ₡100000 para comida" - Directo
-
-💸 **GASTOS:**
-• "Gasté ₡5000" - Te pregunto en qué
-• "Gasté ₡5000 en almuerzo" - Directo
-• "Gasto familia gasolina 40000" - Con contexto
-
-🔧 **GESTIONAR GASTOS:**
-• "Gestionar gastos" - Ver y editar gastos
-• "Eliminar último gasto" - Borrar el más reciente
-• "Mis últimos gastos" - Ver lista
-
-🏷️ **ORGANIZACIONES:**
-• "En qué familias estoy" - Ver tus organizaciones
-• "Mis organizaciones" - Lista completa
-• "Crear familia Mi Hogar" - Nueva familia
-
-📈 **REPORTES:**
-• "Resumen" - Ver tus gastos
-• "Balance" - ¿Cómo vas?
-
-❓ **AYUDA:**
-• "Ayuda" - Ver comandos
-• Solo escríbeme en lenguaje natural 😊""",
-            "action": "help_shown"
-        }
+        return dict(_HELP_RESPONSE)
     
     def _handle_unclear_message(self, message: str, context: ConversationContext) -> Dict[str, Any]:
         """Handle unclear messages with helpful suggestions"""
-        return {
-            "success": False,
-            "message": f"🤔 No estoy seguro qué quieres hacer\n\n💡 **Puedes probar:**\n\n📊 'Crear presupuesto'\n💸 'Gasté ₡5000'\n🏷️ 'En qué familias estoy'\n📈 'Resumen'\n❓ 'Ayuda'\n\n¿Qué te gustaría hacer?",
-            "action": "unclear_message",
-            "suggestions": [
-                "Crear presupuesto",
-                "Gasté ₡5000",
-                "En qué familias estoy",
-                "Resumen",
-                "Ayuda"
-            ]
-        }
+        return {**_UNCLEAR_RESPONSE, "suggestions": list(_UNCLEAR_RESPONSE["suggestions"])}
     
     def _get_or_create_context(self, user_id: str) -> ConversationContext:
         """Get or create conversation context for user"""
         
-        # Clean up expired sessions first
-        self._cleanup_old_sessions()
-        
-        if user_id not in self.active_sessions:
-            self.active_sessions[user_id] = ConversationContext(
-                user_id=user_id,
-                session_id=str(uuid.uuid4()),
-                current_flow="none",
-                flow_data={},
-                last_message_time=datetime.now()
-            )
-        
-        return self.active_sessions[user_id]
+        with self._sessions_lock:
+            # Clean up expired sessions first
+            self._cleanup_old_sessions()
+            
+            context = self.active_sessions.get(user_id)
+            if context is None or datetime.now() - context.last_message_time > self.session_timeout:
+                context = ConversationContext(
+                    user_id=user_id,
+                    session_id=str(uuid.uuid4()),
+                    current_flow="none",
+                    flow_data={},
+                    last_message_time=datetime.now()
+                )
+                self.active_sessions[user_id] = context
+            
+            self.active_sessions.move_to_end(user_id)
+            return context
     
     def _cleanup_old_sessions(self):
-        """Remove expired conversation sessions"""
+        """Remove expired conversation sessions from the least recently used end (caller holds _sessions_lock)"""
         now = datetime.now()
-        expired_users = []
         
-        for user_id, context in self.active_sessions.items():
-            if now - context.last_message_time > self.session_timeout:
-                expired_users.append(user_id)
-        
-        for user_id in expired_users:
-            del self.active_sessions[user_id]
\ No newline at end of file
+        # Stops at the first live session; an expired one further back is
+        # replaced by _get_or_create_context when its user writes again
+        while self.active_sessions:
+            user_id, context = next(iter(self.active_sessions.items()))
+            if now - context.last_message_time <= self.session_timeout:
+                break
+            self.active_sessions.popitem(last=False)
\ No newline at end of file
@@ -1,6 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException, Form, Request
 from sqlalchemy.orm import Session
 from typing import Optional
+import asyncio
 
 from app.core.database import get_db
 from app.core.schemas import WhatsAppMessage, OTPRequest, OTPVerify
@@ -133,7 +134,9 @@ async def whatsapp_webhook(
         # Use Master Router for ALL intelligent processing (handles pending transactions internally)
         try:
             print(f"🤖 Processing with MasterRouter: '{message_body}'")
-            result = master_router.route_and_process(message_body, str(user.id), db)
+            # Routing blocks on DB queries and CrewAI kickoffs (LLM round-trips),
+            # run it in a worker thread so the event loop keeps serving webhooks
+            result = await asyncio.to_thread(master_router.route_and_process, message_body, str(user.id), db)
             print(f"🤖 MasterRouter result: {result}")
             
             if result.get("success", False):
@@ -1,11 +1,16 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import and_
+from sqlalchemy import and_, select
 from app.models.organization import Organization, OrganizationMember, OrganizationInvitation, OrganizationType, OrganizationRole
 from app.models.user import User
 from datetime import datetime, timedelta
-from typing import Optional, List
+from typing import Optional, List, Dict, Tuple
 import uuid
 
+# Member IDs per user, kept briefly in memory since memberships rarely change
+_MEMBER_IDS_TTL = timedelta(minutes=5)
+_MEMBER_IDS_CACHE_MAX = 10000
+_member_ids_cache: Dict[str, Dict] = {}
+
 class OrganizationService:
     @staticmethod
     def create_organization(db: Session, name: str, created_by: str, organization_type: OrganizationType = OrganizationType.family, currency: str = "USD") -> Organization:
@@ -29,6 +34,11 @@ class OrganizationService:
         db.add(organization_member)
         db.commit()
         db.refresh(organization)
+        OrganizationService.invalidate_membership_cache()
+        
+        # Family reports cover the members of the user's organizations
+        from app.agents.report_agent import ReportAgent
+        ReportAgent.invalidate(created_by)
         return organization
     
     @staticmethod
@@ -42,6 +52,59 @@ class OrganizationService:
             )
         ).all()
     
+    @staticmethod
+    def get_user_organizations_with_roles(db: Session, user_id: str) -> List[Tuple[Organization, OrganizationRole]]:
+        """Get all organizations where the user is a member, each with the user's role, in one query."""
+        return db.query(Organization, OrganizationMember.role).join(OrganizationMember).filter(
+            and_(
+                OrganizationMember.user_id == user_id,
+                OrganizationMember.is_active == True,
+                Organization.is_active == True
+            )
+        ).all()
+    
+    @staticmethod
+    def get_member_ids_for_user_orgs(db: Session, user_id: str) -> List[str]:
+        """Get the distinct IDs of active members across all organizations the user belongs to."""
+        cached = _member_ids_cache.get(user_id)
+        if cached and datetime.now() < cached["expires_at"]:
+            return list(cached["member_ids"])
+        
+        user_organization_ids = select(OrganizationMember.organization_id).join(Organization).where(
+            and_(
+                OrganizationMember.user_id == user_id,
+                OrganizationMember.is_active == True,
+                Organization.is_active == True
+            )
+        )
+        
+        rows = db.query(OrganizationMember.user_id).filter(
+            and_(
+                OrganizationMember.organization_id.in_(user_organization_ids),
+                OrganizationMember.is_active == True
+            )
+        ).distinct().all()
+        
+        member_ids = [str(member_user_id) for (member_user_id,) in rows]
+        
+        if len(_member_ids_cache) >= _MEMBER_IDS_CACHE_MAX:
+            _member_ids_cache.clear()
+        _member_ids_cache[user_id] = {
+            "member_ids": member_ids,
+            "expires_at": datetime.now() + _MEMBER_IDS_TTL
+        }
+        
+        return list(member_ids)
+    
+    @staticmethod
+    def invalidate_membership_cache() -> None:
+        """Drop cached member IDs after any membership change.
+        
+        A change in one organization affects the cached IDs of all its members,
+        so the whole cache is cleared rather than a single user's entry.
+        """
+        _member_ids_cache.clear()
+    
     @staticmethod
     def get_organization_by_id(db: Session, organization_id: str) -> Optional[Organization]:
         """Get organization by ID."""
@@ -144,6 +207,11 @@ class OrganizationService:
         db.add(organization_member)
         db.commit()
         db.refresh(organization_member)
+        OrganizationService.invalidate_membership_cache()
+        
+        # Family reports cover the members of the user's organizations
+        from app.agents.report_agent import ReportAgent
+        ReportAgent.invalidate(user_id)
         return organization_member
     
     @staticmethod
@@ -200,6 +268,11 @@ class OrganizationService:
         
         member_to_remove.is_active = False
         db.commit()
+        OrganizationService.invalidate_membership_cache()
+        
+        # Family reports cover the members of the user's organizations
+        from app.agents.report_agent import ReportAgent
+        ReportAgent.invalidate(user_id)
     
     @staticmethod
     def update_member_role(db: Session, organization_id: str, user_id: str, new_role: OrganizationRole, updated_by: str):
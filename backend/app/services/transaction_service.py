@@ -1,10 +1,14 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import func, and_
+from sqlalchemy.orm import Session, load_only, selectinload
+from sqlalchemy import func, and_, select, update, delete
+from sqlalchemy.engine import Row
 from app.models.transaction import Transaction, TransactionType
 from app.core.schemas import TransactionCreate, TransactionUpdate
-from datetime import datetime, date
-from typing import Optional, List
+from datetime import datetime, date, time
+from typing import Optional, List, Dict, Any
 from decimal import Decimal
+import logging
+
+logger = logging.getLogger(__name__)
 
 class TransactionService:
     @staticmethod
@@ -14,6 +18,10 @@ class TransactionService:
         db.commit()
         db.refresh(db_transaction)
         
+        # Cached reports no longer reflect this user's totals
+        from app.agents.report_agent import ReportAgent
+        ReportAgent.invalidate(db_transaction.user_id)
+        
         # Verificar alertas de presupuesto para gastos
         if db_transaction.type == TransactionType.expense:
             from app.services.budget_service import BudgetService
@@ -39,10 +47,14 @@ class TransactionService:
         category: Optional[str] = None,
         transaction_type: Optional[TransactionType] = None,
         start_date: Optional[date] = None,
-        end_date: Optional[date] = None
+        end_date: Optional[date] = None,
+        with_organization: bool = False
     ) -> List[Transaction]:
         query = db.query(Transaction).filter(Transaction.user_id == user_id)
         
+        if with_organization:
+            # One extra query for all rows instead of a lazy load per transaction
+            query = query.options(selectinload(Transaction.organization))
         if category:
             query = query.filter(Transaction.category == category)
         if transaction_type:
@@ -54,6 +66,23 @@ class TransactionService:
             
         return query.order_by(Transaction.date.desc()).offset(skip).limit(limit).all()
 
+    @staticmethod
+    def get_recent_user_transactions(db: Session, user_id: str, limit: int = 10) -> List[Transaction]:
+        """Get the user's latest transactions with only the columns needed to list them.
+        
+        Accessing any other column (category, organization_id) later lazy-loads it per row.
+        """
+        return db.query(Transaction).options(
+            load_only(
+                Transaction.id,
+                Transaction.user_id,
+                Transaction.type,
+                Transaction.amount,
+                Transaction.description,
+                Transaction.date
+            )
+        ).filter(Transaction.user_id == user_id).order_by(Transaction.date.desc()).limit(limit).all()
+
     @staticmethod
     def update_transaction(db: Session, transaction_id: str, transaction_update: TransactionUpdate) -> Optional[Transaction]:
         db_transaction = db.query(Transaction).filter(Transaction.id == transaction_id).first()
@@ -63,17 +92,72 @@ class TransactionService:
                 setattr(db_transaction, key, value)
             db.commit()
             db.refresh(db_transaction)
+            
+            from app.agents.report_agent import ReportAgent
+            ReportAgent.invalidate(db_transaction.user_id)
         return db_transaction
 
     @staticmethod
     def delete_transaction(db: Session, transaction_id: str) -> bool:
         db_transaction = db.query(Transaction).filter(Transaction.id == transaction_id).first()
         if db_transaction:
+            user_id = db_transaction.user_id
             db.delete(db_transaction)
             db.commit()
+            
+            from app.agents.report_agent import ReportAgent
+            ReportAgent.invalidate(user_id)
             return True
         return False
 
+    # Fields a user may change on an existing transaction from chat
+    USER_EDITABLE_FIELDS = frozenset({"amount", "description", "category"})
+
+    @staticmethod
+    def update_user_transaction(db: Session, transaction_id: str, user_id: str, updates: Dict[str, Any]) -> Optional[Row]:
+        """Update a transaction only if it belongs to the user, in a single UPDATE ... RETURNING.
+        
+        Only USER_EDITABLE_FIELDS are applied. Returns the updated type, amount and
+        description, or None if the user has no such transaction.
+        """
+        update_data = {
+            field: value for field, value in updates.items()
+            if field in TransactionService.USER_EDITABLE_FIELDS
+        }
+        if not update_data:
+            return None
+        
+        updated = db.execute(
+            update(Transaction)
+            .where(Transaction.id == transaction_id, Transaction.user_id == user_id)
+            .values(**update_data)
+            .returning(Transaction.type, Transaction.amount, Transaction.description)
+        ).first()
+        db.commit()
+        
+        if updated:
+            from app.agents.report_agent import ReportAgent
+            ReportAgent.invalidate(user_id)
+        return updated
+
+    @staticmethod
+    def delete_user_transaction(db: Session, transaction_id: str, user_id: str) -> Optional[Row]:
+        """Delete a transaction only if it belongs to the user, in a single DELETE ... RETURNING.
+        
+        Returns the deleted type, amount and description, or None if the user has no such transaction.
+        """
+        deleted = db.execute(
+            delete(Transaction)
+            .where(Transaction.id == transaction_id, Transaction.user_id == user_id)
+            .returning(Transaction.type, Transaction.amount, Transaction.description)
+        ).first()
+        db.commit()
+        
+        if deleted:
+            from app.agents.report_agent import ReportAgent
+            ReportAgent.invalidate(user_id)
+        return deleted
+
     @staticmethod
     def get_user_balance(db: Session, user_id: str) -> dict:
         income_sum = db.query(func.coalesce(func.sum(Transaction.amount), 0)).filter(
@@ -94,12 +178,10 @@ class TransactionService:
     def get_transactions_by_date_range(db: Session, user_id: str, start_date: date, end_date: date) -> List[Transaction]:
         """Get all transactions for a user within a specific date range."""
         # Convert dates to datetime for proper comparison with timezone-aware DateTime column
-        from datetime import datetime, time
-        
         start_datetime = datetime.combine(start_date, time.min)  # 00:00:00
         end_datetime = datetime.combine(end_date, time.max)      # 23:59:59.999999
         
-        print(f"DEBUG: Searching with datetime range: {start_datetime} to {end_datetime}")
+        logger.debug("Searching with datetime range: %s to %s", start_datetime, end_datetime)
         
         transactions = db.query(Transaction).filter(
             and_(
@@ -109,9 +191,38 @@ class TransactionService:
             )
         ).order_by(Transaction.date.desc()).all()
         
-        print(f"DEBUG: Query returned {len(transactions)} transactions")
+        logger.debug("Query returned %d transactions", len(transactions))
         return transactions
 
+    @staticmethod
+    def get_report_aggregates(db: Session, user_ids: List[str], start_date: date, end_date: date, personal_only: bool = False) -> List[tuple]:
+        """Get (type, category, total, count) rows for the given users within a date range.
+        
+        Aggregation runs in SQL so reports never hydrate individual Transaction objects.
+        With personal_only, organization transactions are left out.
+        """
+        start_datetime = datetime.combine(start_date, time.min)
+        end_datetime = datetime.combine(end_date, time.max)
+        
+        query = select(
+            Transaction.type,
+            Transaction.category,
+            func.sum(Transaction.amount),
+            # count(*) rather than count(id): id is not in the covering index
+            func.count()
+        ).where(
+            and_(
+                Transaction.user_id.in_(user_ids),
+                Transaction.date >= start_datetime,
+                Transaction.date <= end_datetime
+            )
+        ).group_by(Transaction.type, Transaction.category)
+        
+        if personal_only:
+            query = query.where(Transaction.organization_id.is_(None))
+        
+        return db.execute(query).all()
+
     @staticmethod
     def get_expenses_by_category(db: Session, user_id: str, start_date: Optional[date] = None, end_date: Optional[date] = None) -> List[dict]:
         query = db.query(
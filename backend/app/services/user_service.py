@@ -1,11 +1,18 @@
 from sqlalchemy.orm import Session
 from sqlalchemy import func
+from collections import OrderedDict
 from app.models.user import User
 from app.models.transaction import Transaction, TransactionType
 from app.core.schemas import UserCreate, UserUpdate
 from datetime import datetime, timedelta
 from typing import Optional
 
+# User currencies change rarely but are read on every expense, budget and report;
+# update_user drops the entry so a changed currency shows up immediately
+_CURRENCY_CACHE_TTL = timedelta(minutes=5)
+_CURRENCY_CACHE_MAX = 10000
+_currency_cache: "OrderedDict[str, tuple]" = OrderedDict()
+
 class UserService:
     @staticmethod
     def create_user(db: Session, user: UserCreate) -> User:
@@ -23,6 +30,23 @@ class UserService:
     def get_user(db: Session, user_id: str) -> Optional[User]:
         return db.query(User).filter(User.id == user_id).first()
 
+    @staticmethod
+    def get_user_currency(db: Session, user_id: str) -> Optional[str]:
+        """Currency code of the user (None if the user doesn't exist), cached for a few minutes"""
+        key = str(user_id)
+        now = datetime.now()
+        entry = _currency_cache.get(key)
+        if entry is not None and entry[1] > now:
+            return entry[0]
+        
+        currency = db.query(User.currency).filter(User.id == user_id).scalar()
+        if currency is not None:
+            _currency_cache[key] = (currency, now + _CURRENCY_CACHE_TTL)
+            _currency_cache.move_to_end(key)
+            while len(_currency_cache) > _CURRENCY_CACHE_MAX:
+                _currency_cache.popitem(last=False)
+        return currency
+
     @staticmethod
     def update_user(db: Session, user_id: str, user_update: UserUpdate) -> Optional[User]:
         db_user = db.query(User).filter(User.id == user_id).first()
@@ -32,6 +56,7 @@ class UserService:
                 setattr(db_user, key, value)
             db.commit()
             db.refresh(db_user)
+            _currency_cache.pop(str(db_user.id), None)
         return db_user
 
     @staticmethod
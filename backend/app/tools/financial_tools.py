@@ -6,19 +6,20 @@ Properly designed tools for expense tracking, reporting, and organization manage
 from crewai.tools import tool
 from typing import Optional, Dict, Any
 from sqlalchemy.orm import Session
+from contextvars import ContextVar
 from decimal import Decimal
 import json
 
 
-# Global variables to store context for tools
-_current_db = None
-_current_user_id = None
+# Request-scoped context for tools; webhooks are routed in worker threads,
+# so module globals would let concurrent requests see each other's user
+_current_db: ContextVar = ContextVar("financial_tools_db", default=None)
+_current_user_id: ContextVar = ContextVar("financial_tools_user_id", default=None)
 
 def set_tool_context(db: Session, user_id: str):
     """Set the database session and user ID for tools to use"""
-    global _current_db, _current_user_id
-    _current_db = db
-    _current_user_id = user_id
+    _current_db.set(db)
+    _current_user_id.set(user_id)
 
 
 @tool("add_expense")
@@ -35,8 +36,8 @@ def add_expense_tool(amount: float, description: str, organization_context: str
         from app.models.transaction import TransactionType
         from uuid import UUID
         
-        db = _current_db
-        user_id = _current_user_id
+        db = _current_db.get()
+        user_id = _current_user_id.get()
         
         if not db or not user_id:
             return "❌ Error: Database session or user ID not provided"
@@ -192,8 +193,8 @@ def add_income_tool(amount: float, description: str, organization_context: str =
         from app.models.transaction import TransactionType
         from uuid import UUID
         
-        db = _current_db
-        user_id = _current_user_id
+        db = _current_db.get()
+        user_id = _current_user_id.get()
         
         if not db or not user_id:
             return "❌ Error: Database session or user ID not provided"
@@ -349,10 +350,10 @@ def generate_report_tool(period: str, organization: str = None) -> str:
     Use this when user asks for 'resumen', 'gastos', 'balance', 'reporte', or specific queries like 'resumen personal', 'gastos familia'."""
     
     try:
-        from app.agents.report_agent import ReportAgent
+        from app.agents.report_agent import get_report_agent
         
-        db = _current_db
-        user_id = _current_user_id
+        db = _current_db.get()
+        user_id = _current_user_id.get()
         
         if not db or not user_id:
             return "❌ Error: Database session or user ID not provided"
@@ -389,7 +390,7 @@ def generate_report_tool(period: str, organization: str = None) -> str:
         query_message = " ".join(query_parts)
         
         # Use existing report agent
-        report_agent = ReportAgent(db)
+        report_agent = get_report_agent()
         if report_agent.is_report_request(query_message):
             result = report_agent.generate_report(query_message, user_id, db)
             
@@ -412,8 +413,8 @@ def list_organizations_tool() -> str:
     try:
         from app.services.organization_service import OrganizationService
         
-        db = _current_db
-        user_id = _current_user_id
+        db = _current_db.get()
+        user_id = _current_user_id.get()
         
         if not db or not user_id:
             return "❌ Error: Database session or user ID not provided"
@@ -448,8 +449,8 @@ def create_organization_tool(organization_name: str) -> str:
         from app.services.organization_service import OrganizationService
         from app.models.organization import OrganizationType
         
-        db = _current_db
-        user_id = _current_user_id
+        db = _current_db.get()
+        user_id = _current_user_id.get()
         
         if not db or not user_id:
             return "❌ Error: Database session or user ID not provided"
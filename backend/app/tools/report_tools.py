@@ -4,17 +4,56 @@ Tools that can be used by ReportAgent for generating financial reports
 """
 
 from crewai.tools import tool
-from typing import Dict, Any, List, Optional
+from collections import defaultdict
+from contextvars import ContextVar
 from datetime import datetime, timedelta
+from operator import itemgetter
+import heapq
+import re
 
+from app.agents.report_agent import ORGANIZATION_KEYWORDS
 
-# Global variables to store context for tools
-_current_db = None
+
+# Request-scoped context for tools; a ContextVar keeps concurrent requests
+# (threads or asyncio tasks) from seeing each other's session
+_current_db: ContextVar = ContextVar("report_tools_db", default=None)
 
 def set_report_tool_context(db):
     """Set the database session for report tools to use"""
-    global _current_db
-    _current_db = db
+    _current_db.set(db)
+
+
+def _keyword_table(table) -> list:
+    """Compile (value, keywords) pairs into ordered (pattern, value) pairs."""
+    return [(re.compile("|".join(map(re.escape, keywords))), value) for value, keywords in table]
+
+
+def _first_match(patterns, text: str, default):
+    """Return the value of the first pattern found in text, checked in table order."""
+    for pattern, value in patterns:
+        if pattern.search(text):
+            return value
+    return default
+
+
+# Keyword tables for detect_report_type, compiled once at import
+_DETECT_PERIOD_PATTERNS = _keyword_table((
+    ("today", ("hoy", "today")),
+    ("this_week", ("esta semana", "semana actual")),
+    ("last_week", ("semana pasada", "última semana")),
+    ("this_month", ("este mes", "mes actual")),
+    ("last_month", ("mes pasado", "último mes")),
+    ("last_7_days", ("últimos 7", "última semana")),
+    ("last_30_days", ("últimos 30",)),
+))
+
+# Shared with ReportAgent, which keys cached reports by the same family detection
+_DETECT_ORGANIZATION_PATTERNS = _keyword_table(ORGANIZATION_KEYWORDS)
+
+_DETECT_REPORT_TYPE_PATTERNS = _keyword_table((
+    ("detailed", ("detallado", "completo", "full")),
+    ("summary", ("rápido", "resumen", "summary")),
+))
 
 
 @tool("get_transaction_data")
@@ -27,57 +66,53 @@ def get_transaction_data_tool(user_id: str, period: str, organization: str = Non
         from app.services.organization_service import OrganizationService
         from app.models.transaction import TransactionType
         
-        db = _current_db
+        db = _current_db.get()
         if not db:
             return "Error: Database session not available"
         
         # Determine date range
         start_date, end_date = _get_date_range(period)
         
-        # Get transactions based on organization filter
+        # Resolve which users (and which of their transactions) the report covers
+        personal_only = False
         if organization and organization.lower() in ["family", "familia", "familiar"]:
-            # Get family transactions (all organizations user belongs to)
-            transactions = _get_family_transactions(db, user_id, start_date, end_date)
+            # Family: members of all organizations the user belongs to
+            user_ids = OrganizationService.get_member_ids_for_user_orgs(db, user_id) or [user_id]
         elif organization and organization.lower() == "personal":
-            # Get only personal transactions (not from organizations)
-            transactions = _get_personal_only_transactions(db, user_id, start_date, end_date)
+            # Only personal transactions (not from organizations)
+            user_ids = [user_id]
+            personal_only = True
         else:
-            # Get all user transactions (personal + organizations)
-            transactions = TransactionService.get_transactions_by_date_range(
-                db, user_id, start_date, end_date
-            )
-        
-        # Calculate totals
-        total_expenses = sum(float(t.amount) for t in transactions if t.type == TransactionType.expense)
-        total_income = sum(float(t.amount) for t in transactions if t.type == TransactionType.income)
+            # All user transactions (personal + organizations)
+            user_ids = [user_id]
         
-        # Group by category
-        category_totals = {}
-        for transaction in transactions:
-            if transaction.type == TransactionType.expense:
-                category = transaction.category or "Sin categoría"
-                category_totals[category] = category_totals.get(category, 0) + float(transaction.amount)
+        # Totals per (type, category) computed by the database
+        rows = TransactionService.get_report_aggregates(
+            db, user_ids, start_date, end_date, personal_only=personal_only
+        )
         
-        # Sort categories by amount
-        top_categories = sorted(category_totals.items(), key=lambda x: x[1], reverse=True)[:5]
+        # Fold the few aggregate rows into totals and category sums
+        expense_type = TransactionType.expense
+        income_type = TransactionType.income
+        total_transactions = 0
+        total_expenses = 0.0
+        total_income = 0.0
+        category_totals = defaultdict(float)
+        for transaction_type, category, amount, count in rows:
+            amount = float(amount)
+            total_transactions += count
+            if transaction_type is expense_type:
+                total_expenses += amount
+                category_totals[category or "Sin categoría"] += amount
+            elif transaction_type is income_type:
+                total_income += amount
+        
+        # Only the top 3 categories reach the AI
+        top_categories = heapq.nlargest(3, category_totals.items(), key=itemgetter(1))
+        net_balance = total_income - total_expenses
         
         # Format result as string for AI consumption
-        result = {
-            "period": period,
-            "start_date": start_date.isoformat(),
-            "end_date": end_date.isoformat(),
-            "total_transactions": len(transactions),
-            "total_expenses": total_expenses,
-            "total_income": total_income,
-            "net_balance": total_income - total_expenses,
-            "top_categories": top_categories,
-            "transaction_count": {
-                "expenses": len([t for t in transactions if t.type == TransactionType.expense]),
-                "income": len([t for t in transactions if t.type == TransactionType.income])
-            }
-        }
-        
-        return f"Datos obtenidos: {len(transactions)} transacciones, Gastos: {total_expenses}, Ingresos: {total_income}, Balance: {total_income - total_expenses}, Categorías principales: {dict(top_categories[:3])}"
+        return f"Datos obtenidos: {total_transactions} transacciones, Gastos: {total_expenses}, Ingresos: {total_income}, Balance: {net_balance}, Categorías principales: {dict(top_categories)}"
         
     except Exception as e:
         return f"Error retrieving transaction data: {str(e)}"
@@ -92,8 +127,6 @@ def format_report_tool(transaction_data: str, currency_symbol: str = "₡", repo
         # Parse the transaction data string
         # Expected format: "Datos obtenidos: X transacciones, Gastos: Y, Ingresos: Z, Balance: W, Categorías principales: {...}"
         
-        import re
-        
         # Extract numbers from the data string
         transactions_match = re.search(r'(\d+)\s+transacciones', transaction_data)
         expenses_match = re.search(r'Gastos:\s*([\d.]+)', transaction_data)
@@ -116,83 +149,82 @@ def format_report_tool(transaction_data: str, currency_symbol: str = "₡", repo
             except:
                 pass
         
-        # Determine period from context
-        period = "período actual"
-        if "hoy" in transaction_data.lower():
-            period = "hoy"
-        elif "semana" in transaction_data.lower():
-            period = "esta semana"
-        elif "mes" in transaction_data.lower():
-            period = "este mes"
+        # Determine period from context (already in Spanish, ready for display)
+        transaction_data_lower = transaction_data.lower()
+        period_text = "período actual"
+        if "hoy" in transaction_data_lower:
+            period_text = "hoy"
+        elif "semana" in transaction_data_lower:
+            period_text = "esta semana"
+        elif "mes" in transaction_data_lower:
+            period_text = "este mes"
         
-        # Period name translation
-        period_names = {
-            "today": "hoy",
-            "this_week": "esta semana",
-            "last_week": "la semana pasada",
-            "this_month": "este mes",
-            "last_month": "el mes pasado",
-            "last_7_days": "los últimos 7 días",
-            "last_30_days": "los últimos 30 días"
-        }
-        
-        period_text = period_names.get(period, period)
+        if total_transactions == 0:
+            return f"📝 No tienes transacciones registradas para {period_text}"
         
         if report_type == "summary":
             # Quick summary format
-            report = f"📊 **Resumen de {period_text}**\n\n"
-            report += f"💸 Gastos: {currency_symbol}{total_expenses:,.0f}\n"
-            report += f"💰 Ingresos: {currency_symbol}{total_income:,.0f}\n"
-            report += f"📈 Balance: {currency_symbol}{net_balance:,.0f}\n"
-            
-            if total_transactions == 0:
-                report = f"📝 No tienes transacciones registradas para {period_text}"
-            
-            return report
+            lines = [
+                f"📊 **Resumen de {period_text}**",
+                "",
+                f"💸 Gastos: {currency_symbol}{total_expenses:,.0f}",
+                f"💰 Ingresos: {currency_symbol}{total_income:,.0f}",
+                f"📈 Balance: {currency_symbol}{net_balance:,.0f}",
+                ""
+            ]
+            return "\n".join(lines)
         
         elif report_type == "detailed":
             # Detailed format with categories
-            report = f"📊 **Reporte Detallado - {period_text.title()}**\n\n"
-            report += f"📈 **Resumen Financiero:**\n"
-            report += f"• Total transacciones: {total_transactions}\n"
-            report += f"• Gastos totales: {currency_symbol}{total_expenses:,.0f}\n"
-            report += f"• Ingresos totales: {currency_symbol}{total_income:,.0f}\n"
-            report += f"• Balance neto: {currency_symbol}{net_balance:,.0f}\n\n"
+            lines = [
+                f"📊 **Reporte Detallado - {period_text.title()}**",
+                "",
+                "📈 **Resumen Financiero:**",
+                f"• Total transacciones: {total_transactions}",
+                f"• Gastos totales: {currency_symbol}{total_expenses:,.0f}",
+                f"• Ingresos totales: {currency_symbol}{total_income:,.0f}",
+                f"• Balance neto: {currency_symbol}{net_balance:,.0f}",
+                ""
+            ]
             
             if top_categories:
-                report += f"🏆 **Top Categorías de Gastos:**\n"
-                for i, (category, amount) in enumerate(top_categories[:5], 1):
-                    percentage = (amount / total_expenses * 100) if total_expenses > 0 else 0
-                    report += f"{i}. {category}: {currency_symbol}{amount:,.0f} ({percentage:.1f}%)\n"
+                lines.append("🏆 **Top Categorías de Gastos:**")
+                lines.extend(
+                    f"{i}. {category}: {currency_symbol}{amount:,.0f} "
+                    f"({(amount / total_expenses * 100) if total_expenses > 0 else 0:.1f}%)"
+                    for i, (category, amount) in enumerate(top_categories[:5], 1)
+                )
             
             # Add insights
+            lines.append("")
             if net_balance > 0:
                 savings_rate = (net_balance / total_income * 100) if total_income > 0 else 0
-                report += f"\n💡 **Insight:** Ahorraste {savings_rate:.1f}% de tus ingresos"
+                lines.append(f"💡 **Insight:** Ahorraste {savings_rate:.1f}% de tus ingresos")
             else:
-                report += f"\n⚠️ **Atención:** Gastaste más de lo que ingresaste"
-                
-            if total_transactions == 0:
-                report = f"📝 No tienes transacciones registradas para {period_text}"
+                lines.append("⚠️ **Atención:** Gastaste más de lo que ingresaste")
             
-            return report
+            return "\n".join(lines)
         
         else:
             # Standard format
-            report = f"📊 **Resumen de {period_text}**\n\n"
-            report += f"💸 Gastos: {currency_symbol}{total_expenses:,.0f}\n"
-            report += f"💰 Ingresos: {currency_symbol}{total_income:,.0f}\n"
-            report += f"📈 Balance: {currency_symbol}{net_balance:,.0f}\n"
+            lines = [
+                f"📊 **Resumen de {period_text}**",
+                "",
+                f"💸 Gastos: {currency_symbol}{total_expenses:,.0f}",
+                f"💰 Ingresos: {currency_symbol}{total_income:,.0f}",
+                f"📈 Balance: {currency_symbol}{net_balance:,.0f}"
+            ]
             
             if top_categories:
-                report += f"\n🏆 **Top categorías:**\n"
-                for category, amount in top_categories[:3]:
-                    report += f"• {category}: {currency_symbol}{amount:,.0f}\n"
-            
-            if total_transactions == 0:
-                report = f"📝 No tienes transacciones registradas para {period_text}"
+                lines.append("")
+                lines.append("🏆 **Top categorías:**")
+                lines.extend(
+                    f"• {category}: {currency_symbol}{amount:,.0f}"
+                    for category, amount in top_categories[:3]
+                )
             
-            return report
+            lines.append("")
+            return "\n".join(lines)
             
     except Exception as e:
         return f"Error formatting report: {str(e)}"
@@ -204,33 +236,11 @@ def detect_report_type_tool(message: str) -> str:
     Detects period, organization filter, and report detail level."""
     
     try:
-        message_lower = message.lower().strip()
-        
-        # Detect period
-        period = "this_month"  # default
-        if any(word in message_lower for word in ["hoy", "today"]):
-            period = "today"
-        elif any(word in message_lower for word in ["esta semana", "semana actual"]):
-            period = "this_week"
-        elif any(word in message_lower for word in ["semana pasada", "última semana"]):
-            period = "last_week"
-        elif any(word in message_lower for word in ["este mes", "mes actual"]):
-            period = "this_month"
-        elif any(word in message_lower for word in ["mes pasado", "último mes"]):
-            period = "last_month"
-        elif any(word in message_lower for word in ["últimos 7", "última semana"]):
-            period = "last_7_days"
-        elif any(word in message_lower for word in ["últimos 30"]):
-            period = "last_30_days"
+        message_lower = message.casefold().strip()
         
-        # Detect organization filter
-        organization = None
-        if any(word in message_lower for word in ["personal", "mío", "mio", "propio", "individual"]):
-            organization = "personal"
-        elif any(word in message_lower for word in ["familia", "familiar", "family", "mi hogar", "hogar", "casa"]):
-            organization = "family"
-        elif any(word in message_lower for word in ["empresa", "trabajo", "work", "negocio"]):
-            organization = "empresa"
+        # Detect period, organization filter and report detail level
+        period = _first_match(_DETECT_PERIOD_PATTERNS, message_lower, "this_month")
+        organization = _first_match(_DETECT_ORGANIZATION_PATTERNS, message_lower, None)
         
         # Detect specific organization names
         organization_name = None
@@ -239,12 +249,7 @@ def detect_report_type_tool(message: str) -> str:
         elif "hogar" in message_lower:
             organization_name = "Hogar"
         
-        # Detect report detail level
-        report_type = "standard"
-        if any(word in message_lower for word in ["detallado", "completo", "full"]):
-            report_type = "detailed"
-        elif any(word in message_lower for word in ["rápido", "resumen", "summary"]):
-            report_type = "summary"
+        report_type = _first_match(_DETECT_REPORT_TYPE_PATTERNS, message_lower, "standard")
         
         result = {
             "period": period,
@@ -297,65 +302,6 @@ def _get_date_range(period: str) -> tuple:
         return first_day, today
 
 
-def _get_personal_only_transactions(db, user_id: str, start_date, end_date) -> List:
-    """Get only personal transactions (not from organizations)"""
-    try:
-        from app.services.transaction_service import TransactionService
-        
-        # Get user transactions and filter out organization transactions
-        all_transactions = TransactionService.get_transactions_by_date_range(
-            db, user_id, start_date, end_date
-        )
-        
-        # Filter to only personal transactions (organization_id is None)
-        personal_transactions = [t for t in all_transactions if t.organization_id is None]
-        
-        return personal_transactions
-        
-    except Exception as e:
-        print(f"Error getting personal transactions: {e}")
-        return []
-
-
-def _get_family_transactions(db, user_id: str, start_date, end_date) -> List:
-    """Get transactions for all organization members the user belongs to"""
-    try:
-        from app.services.organization_service import OrganizationService
-        from app.services.transaction_service import TransactionService
-        
-        # Get user's organizations
-        user_organizations = OrganizationService.get_user_organizations(db, user_id)
-        
-        if not user_organizations:
-            # No organizations, return individual transactions
-            return TransactionService.get_transactions_by_date_range(
-                db, user_id, start_date, end_date
-            )
-        
-        all_transactions = []
-        
-        for organization in user_organizations:
-            # Get all organization members
-            organization_members = OrganizationService.get_organization_members(db, str(organization.id))
-            
-            for member in organization_members:
-                # Get transactions for each member
-                member_transactions = TransactionService.get_transactions_by_date_range(
-                    db, str(member.user_id), start_date, end_date
-                )
-                all_transactions.extend(member_transactions)
-        
-        # Remove duplicates and sort by date
-        unique_transactions = list(set(all_transactions))
-        unique_transactions.sort(key=lambda x: x.date, reverse=True)
-        
-        return unique_transactions
-        
-    except Exception as e:
-        print(f"Error getting family transactions: {e}")
-        return []
-
-
 # Export tools for easy access
 GetTransactionDataTool = get_transaction_data_tool
 FormatReportTool = format_report_tool
@@ -0,0 +1,32 @@
+"""
+Utilities for reading JSON out of free-form text such as AI responses.
+"""
+import json
+from typing import Any, Dict, Optional
+
+_JSON_DECODER = json.JSONDecoder()
+
+
+def parse_json_object(text: str) -> Optional[Dict[str, Any]]:
+    """
+    Parse the first JSON object embedded in text, e.g. an AI answer wrapped in prose.
+    
+    Decodes in place from each "{" until one parses, so the text is scanned once
+    by the JSON parser instead of being cut out with a regex and parsed again.
+    
+    Args:
+        text: Text that may contain a JSON object
+    
+    Returns:
+        The first JSON object found, or None if there is none
+    """
+    start = text.find("{")
+    while start != -1:
+        try:
+            value, _ = _JSON_DECODER.raw_decode(text, start)
+            if isinstance(value, dict):
+                return value
+        except ValueError:
+            pass
+        start = text.find("{", start + 1)
+    return None